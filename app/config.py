@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import Literal
+from typing import Literal, Optional
 
 class Settings(BaseSettings):
     # App settings
@@ -12,7 +12,7 @@ class Settings(BaseSettings):
     workers: int = 1
     
     # Engine settings
-    engine_type: Literal["simple", "vllm"] = "simple"
+    engine_type: Literal["simple", "tensor_parallel", "fake", "vllm"] = "simple"
     model_name: str = "gpt2"  # default to a small model
     max_tokens: int = 512
     temperature: float = 0.7
@@ -21,6 +21,33 @@ class Settings(BaseSettings):
     max_concurrent_requests: int = 10
     request_timeout: int = 30
     
+    # Continuous batching: concurrent requests (including different LoRA adapters) share decode steps
+    generation_max_batch_size: int = 8
+    
+    # LoRA adapter settings (simple engine)
+    lora_adapter_dir: Optional[str] = None  # one PEFT adapter directory per adapter name
+    lora_max_adapters: int = 8
+    
+    # Tensor-parallel settings (engine_type="tensor_parallel")
+    tp_world_size: int = 2
+    tp_threads_per_shard: Optional[int] = None  # defaults to cpu_count // tp_world_size
+    
+    # Fake engine settings (engine_type="fake", no model: for tests and router setups)
+    fake_token_delay_ms: float = 0.0
+    
+    # Embedding settings
+    embedding_model_name: Optional[str] = None  # reuse model_name when unset
+    embedding_max_batch_size: int = 32
+    embedding_max_wait_ms: float = 5.0
+    
+    # Router settings (app.router)
+    router_replicas: str = ""  # comma separated, e.g. "http://localhost:8001,http://localhost:8002"
+    router_virtual_nodes: int = 100
+    router_load_factor: float = 1.25  # max load relative to the average before spilling over
+    router_prefix_tokens: int = 32
+    router_health_interval: float = 5.0
+    router_health_timeout: float = 2.0
+    
     # Backpressure settings (Milestone 3)
     enable_backpressure: bool = False
     queue_capacity: int = 100
@@ -1,12 +1,16 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse, StreamingResponse
 from contextlib import asynccontextmanager
+import json
 import time
 import uuid
 
 from app.config import settings
-from app.models import ChatRequest, ChatResponse, HealthResponse
+from app.models import ChatRequest, ChatResponse, EmbeddingRequest, EmbeddingResponse, HealthResponse
+from engine.fake_engine import FakeEngine
+from engine.lora import AdapterNotFoundError, UnsupportedAdapterError
 from engine.simple_engine import SimpleEngine
+from engine.tp_engine import TensorParallelEngine
 from middleware.metrics import MetricsMiddleware, metrics_endpoint, record_generation_metrics
 
 # global variables
@@ -23,7 +27,23 @@ async def lifespan(app: FastAPI):
     app_start_time = time.time()
     
     if settings.engine_type == "simple":
-        engine = SimpleEngine(model_name=settings.model_name)
+        engine = SimpleEngine(
+            model_name=settings.model_name,
+            embedding_model_name=settings.embedding_model_name,
+            embedding_max_batch_size=settings.embedding_max_batch_size,
+            embedding_max_wait_ms=settings.embedding_max_wait_ms,
+            generation_max_batch_size=settings.generation_max_batch_size,
+            lora_adapter_dir=settings.lora_adapter_dir,
+            lora_max_adapters=settings.lora_max_adapters,
+        )
+    elif settings.engine_type == "tensor_parallel":
+        engine = TensorParallelEngine(
+            model_name=settings.model_name,
+            world_size=settings.tp_world_size,
+            threads_per_shard=settings.tp_threads_per_shard,
+        )
+    elif settings.engine_type == "fake":
+        engine = FakeEngine(token_delay_ms=settings.fake_token_delay_ms)
     else:
         raise ValueError(f"Unknown engine type: {settings.engine_type}")
     
@@ -54,19 +74,21 @@ async def health_check():
     """health check endpoint"""
     from middleware.metrics import requests_total, requests_in_progress
     
-    # get total requests
+    # get total requests (no samples until the first request has been recorded)
     total_requests = sum(
-        metric.collect()[0].samples[0].value 
-        for metric in [requests_total]
+        sample.value
+        for sample in requests_total.collect()[0].samples
+        if sample.name.endswith("_total")
     )
+    active_requests = requests_in_progress.collect()[0].samples[0].value
     
     return HealthResponse(
         status="healthy",
         version=settings.app_version,
         model=engine.model_name,
         uptime=time.time() - app_start_time,
-        requests_total=0,
-        requests_active=0
+        requests_total=int(total_requests),
+        requests_active=int(active_requests)
     )
 
 # Metrics endpoint
@@ -86,12 +108,29 @@ async def chat_completions(request: ChatRequest):
     try:
         if request.stream:
             # streaming response
+            stream = engine.generate_stream(
+                messages=request.messages,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens,
+                stop=request.stop,
+                adapter=request.adapter
+            )
+            # wait for the first chunk so setup errors (e.g. unknown adapter) still get a status code
+            first_chunk = await stream.__anext__()
+            
             async def stream_generator():
-                async for chunk in engine.generate_stream(
-                    messages=request.messages,
-                    temperature=request.temperature,
-                    max_tokens=request.max_tokens
-                ):
+                finish_reason = None
+                
+                async def chunks():
+                    yield first_chunk
+                    async for chunk in stream:
+                        yield chunk
+                
+                async for chunk in chunks():
+                    if chunk.finish_reason is not None:
+                        finish_reason = chunk.finish_reason
+                    if not chunk.text:
+                        continue
                     chunk_data = {
                         "id": request_id,
                         "object": "chat.completion.chunk",
@@ -99,11 +138,11 @@ async def chat_completions(request: ChatRequest):
                         "model": engine.model_name,
                         "choices": [{
                             "index": 0,
-                            "delta": {"content": chunk},
+                            "delta": {"content": chunk.text},
                             "finish_reason": None
                         }]
                     }
-                    yield f"data: {chunk_data}\n\n"
+                    yield f"data: {json.dumps(chunk_data)}\n\n"
                 
                 # final chunk
                 final_chunk = {
@@ -114,10 +153,10 @@ async def chat_completions(request: ChatRequest):
                     "choices": [{
                         "index": 0,
                         "delta": {},
-                        "finish_reason": "stop"
+                        "finish_reason": finish_reason
                     }]
                 }
-                yield f"data: {final_chunk}\n\n"
+                yield f"data: {json.dumps(final_chunk)}\n\n"
                 yield "data: [DONE]\n\n"
             
             return StreamingResponse(
@@ -126,15 +165,16 @@ async def chat_completions(request: ChatRequest):
             )
         else:
             # non-streaming response
-            response_text = await engine.generate(
+            result = await engine.generate(
                 messages=request.messages,
                 temperature=request.temperature,
-                max_tokens=request.max_tokens
+                max_tokens=request.max_tokens,
+                stop=request.stop,
+                adapter=request.adapter
             )
             
-            # calculate prompt and completion tokens（simplified）
-            prompt_tokens = sum(len(m.content.split()) for m in request.messages)
-            completion_tokens = len(response_text.split())
+            prompt_tokens = result.prompt_tokens
+            completion_tokens = result.completion_tokens
             total_time = time.time() - start_time
             
             # record generation metrics
@@ -152,9 +192,9 @@ async def chat_completions(request: ChatRequest):
                     "index": 0,
                     "message": {
                         "role": "assistant",
-                        "content": response_text
+                        "content": result.text
                     },
-                    "finish_reason": "stop"
+                    "finish_reason": result.finish_reason
                 }],
                 usage={
                     "prompt_tokens": prompt_tokens,
@@ -163,6 +203,82 @@ async def chat_completions(request: ChatRequest):
                 }
             )
     
+    except AdapterNotFoundError as e:
+        return JSONResponse(
+            status_code=404,
+            content={
+                "error": {
+                    "message": str(e),
+                    "type": type(e).__name__,
+                    "code": "adapter_not_found"
+                }
+            }
+        )
+    
+    except UnsupportedAdapterError as e:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "error": {
+                    "message": str(e),
+                    "type": type(e).__name__,
+                    "code": "unsupported_adapter"
+                }
+            }
+        )
+    
+    except Exception as e:
+        from middleware.metrics import engine_errors
+        engine_errors.labels(error_type=type(e).__name__).inc()
+        
+        return JSONResponse(
+            status_code=500,
+            content={
+                "error": {
+                    "message": str(e),
+                    "type": type(e).__name__,
+                    "code": "internal_error"
+                }
+            }
+        )
+
+# Embeddings endpoint
+@app.post("/v1/embeddings")
+async def embeddings(request: EmbeddingRequest):
+    """OpenAI-compatible embeddings endpoint"""
+    
+    if not engine.supports_embeddings:
+        return JSONResponse(
+            status_code=501,
+            content={
+                "error": {
+                    "message": f"ENGINE_TYPE={settings.engine_type} does not serve embeddings",
+                    "type": "NotImplementedError",
+                    "code": "embeddings_not_supported"
+                }
+            }
+        )
+    
+    inputs = [request.input] if isinstance(request.input, str) else request.input
+    
+    try:
+        results = await engine.embed(inputs)
+        
+        # tokens actually fed to the embedding model (after truncation)
+        prompt_tokens = sum(result.prompt_tokens for result in results)
+        
+        return EmbeddingResponse(
+            data=[
+                {"object": "embedding", "index": i, "embedding": result.embedding}
+                for i, result in enumerate(results)
+            ],
+            model=engine.embedding_model_name,
+            usage={
+                "prompt_tokens": prompt_tokens,
+                "total_tokens": prompt_tokens
+            }
+        )
+    
     except Exception as e:
         from middleware.metrics import engine_errors
         engine_errors.labels(error_type=type(e).__name__).inc()
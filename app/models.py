@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Union
 from enum import Enum
 
 class Role(str, Enum):
@@ -16,6 +16,8 @@ class ChatRequest(BaseModel):
     temperature: Optional[float] = Field(default=0.7, ge=0.0, le=2.0)
     max_tokens: Optional[int] = Field(default=512, ge=1, le=4096)
     stream: Optional[bool] = False
+    stop: Optional[Union[str, List[str]]] = None
+    adapter: Optional[str] = None  # name of a LoRA adapter to apply on top of the base model
     
     model_config = {
         "json_schema_extra": {
@@ -31,6 +33,13 @@ class ChatRequest(BaseModel):
         }
     }
 
+class Generation(BaseModel):
+    """engine output: a full response, or one streamed delta (finish_reason set on the last one)"""
+    text: str
+    finish_reason: Optional[str] = None  # 'stop' or 'length'
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
 class ChatResponse(BaseModel):
     id: str
     object: str = "chat.completion"
@@ -46,6 +55,32 @@ class StreamChunk(BaseModel):
     model: str
     choices: List[Dict[str, Any]]
 
+class EmbeddingRequest(BaseModel):
+    input: Union[str, List[str]]
+    model: Optional[str] = None
+    encoding_format: Optional[str] = "float"
+    
+    model_config = {
+        "json_schema_extra": {
+            "examples": [
+                {
+                    "input": ["The food was delicious", "The service was slow"]
+                }
+            ]
+        }
+    }
+
+class Embedding(BaseModel):
+    """engine output for one embedding input"""
+    embedding: List[float]
+    prompt_tokens: int = 0
+
+class EmbeddingResponse(BaseModel):
+    object: str = "list"
+    data: List[Dict[str, Any]]
+    model: str
+    usage: Dict[str, int]
+
 class HealthResponse(BaseModel):
     status: str
     version: str
@@ -0,0 +1,243 @@
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import bisect
+import hashlib
+import math
+
+import httpx
+
+from app.config import settings
+from middleware.metrics import MetricsMiddleware, metrics_endpoint, record_routing_metrics, router_replica_healthy
+
+# headers that describe a single hop and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host", "content-length",
+}
+
+class ConsistentHashRing:
+    """consistent hash ring with bounded-load spillover (Mirrokni et al.)"""
+
+    def __init__(self, replicas: List[str], virtual_nodes: int = 100, load_factor: float = 1.25):
+        self.replicas = list(replicas)
+        self.load_factor = load_factor
+
+        ring = sorted(
+            (self._hash(f"{replica}#{i}"), replica)
+            for replica in self.replicas
+            for i in range(virtual_nodes)
+        )
+        self._hashes = [h for h, _ in ring]
+        self._owners = [replica for _, replica in ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def select(self, key: str, load: Dict[str, int], healthy: Set[str]) -> Tuple[Optional[str], bool]:
+        """walk clockwise from the key to the first healthy replica under capacity
+
+        returns (replica, spilled) where spilled means the key's preferred replica was skipped
+        """
+        candidates = [replica for replica in self.replicas if replica in healthy]
+        if not candidates:
+            return None, False
+
+        # no replica may take more than load_factor times the average (counting this request)
+        total = sum(load.get(replica, 0) for replica in candidates)
+        capacity = math.ceil(self.load_factor * (total + 1) / len(candidates))
+
+        start = bisect.bisect(self._hashes, self._hash(key))
+        preferred = None
+        for i in range(len(self._owners)):
+            replica = self._owners[(start + i) % len(self._owners)]
+            if replica not in healthy:
+                continue
+            preferred = preferred or replica
+            if load.get(replica, 0) < capacity:
+                return replica, replica != preferred
+
+        return preferred, False
+
+def _prefix_key(texts: List[str], prefix_tokens: int) -> str:
+    """leading whitespace tokens of the prompt, so shared system prompts map to the same replica"""
+    tokens = []
+    for text in texts:
+        tokens.extend(text.split())
+        if len(tokens) >= prefix_tokens:
+            break
+    return " ".join(tokens[:prefix_tokens])
+
+# global variables
+replicas = [url.strip().rstrip("/") for url in settings.router_replicas.split(",") if url.strip()]
+ring = ConsistentHashRing(replicas, settings.router_virtual_nodes, settings.router_load_factor)
+healthy: Set[str] = set(replicas)
+inflight: Dict[str, int] = {replica: 0 for replica in replicas}
+client: Optional[httpx.AsyncClient] = None
+
+async def check_replica(replica: str):
+    """mark a replica healthy iff its /health endpoint answers 200"""
+    try:
+        response = await client.get(f"{replica}/health", timeout=settings.router_health_timeout)
+        ok = response.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+
+    if ok:
+        healthy.add(replica)
+    else:
+        healthy.discard(replica)
+    router_replica_healthy.labels(replica=replica).set(1 if ok else 0)
+
+async def health_check_loop():
+    """periodically health-check every replica"""
+    while True:
+        await asyncio.gather(*(check_replica(replica) for replica in replicas))
+        await asyncio.sleep(settings.router_health_interval)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """router lifespan manager"""
+    global client
+
+    if not replicas:
+        raise ValueError("ROUTER_REPLICAS must list at least one replica URL")
+
+    print(f"Routing across {len(replicas)} replicas: {', '.join(replicas)}")
+    # no read timeout: streamed generations can be long
+    client = httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=None))
+    health_task = asyncio.create_task(health_check_loop())
+
+    yield
+
+    health_task.cancel()
+    await client.aclose()
+    print("Router shutdown complete")
+
+# create FastAPI app
+app = FastAPI(
+    title=f"{settings.app_name} Router",
+    version=settings.app_version,
+    lifespan=lifespan
+)
+
+# add metrics middleware
+if settings.enable_metrics:
+    app.add_middleware(MetricsMiddleware)
+
+async def proxy(request: Request, key: str):
+    """forward the request to the replica owning the key, streaming the response back unbuffered"""
+    body = await request.body()
+    headers = {
+        name: value for name, value in request.headers.items()
+        if name.lower() not in HOP_BY_HOP_HEADERS
+    }
+
+    # on connection failure, drop the replica and re-route
+    for _ in range(len(replicas)):
+        replica, spilled = ring.select(key, inflight, healthy)
+        if replica is None:
+            break
+
+        inflight[replica] += 1
+        upstream_request = client.build_request(
+            request.method,
+            f"{replica}{request.url.path}",
+            params=request.query_params,
+            headers=headers,
+            content=body,
+        )
+        try:
+            upstream = await client.send(upstream_request, stream=True)
+        except httpx.TransportError:
+            inflight[replica] -= 1
+            healthy.discard(replica)
+            router_replica_healthy.labels(replica=replica).set(0)
+            record_routing_metrics(replica, "error")
+            continue
+
+        record_routing_metrics(replica, "spillover" if spilled else "affinity")
+
+        async def stream_body(upstream=upstream, replica=replica):
+            try:
+                async for chunk in upstream.aiter_raw():
+                    yield chunk
+            finally:
+                await upstream.aclose()
+                inflight[replica] -= 1
+
+        response_headers = {
+            name: value for name, value in upstream.headers.items()
+            if name.lower() not in HOP_BY_HOP_HEADERS
+        }
+        response_headers["x-served-by"] = replica
+        return StreamingResponse(
+            stream_body(),
+            status_code=upstream.status_code,
+            headers=response_headers,
+        )
+
+    return JSONResponse(
+        status_code=503,
+        content={
+            "error": {
+                "message": "No healthy replica available",
+                "type": "ServiceUnavailable",
+                "code": "no_healthy_replica"
+            }
+        }
+    )
+
+# Health check endpoint
+@app.get("/health")
+async def health_check():
+    """router health: healthy while at least one replica is"""
+    return JSONResponse(
+        status_code=200 if healthy else 503,
+        content={
+            "status": "healthy" if healthy else "unhealthy",
+            "version": settings.app_version,
+            "replicas": {
+                replica: {
+                    "healthy": replica in healthy,
+                    "inflight": inflight[replica]
+                }
+                for replica in replicas
+            }
+        }
+    )
+
+# Metrics endpoint
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    return metrics_endpoint()
+
+# Chat completion endpoint
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """route by the leading tokens of the conversation (system prompt and history)"""
+    try:
+        payload = await request.json()
+        texts = [str(message.get("content", "")) for message in payload.get("messages", [])]
+    except (ValueError, AttributeError):
+        texts = []
+    # the final message changes on every turn, the conversation before it is the shared prefix
+    if len(texts) > 1:
+        texts = texts[:-1]
+    return await proxy(request, _prefix_key(texts, settings.router_prefix_tokens))
+
+# Embeddings endpoint
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    """route by the leading tokens of the first input"""
+    try:
+        payload = await request.json()
+        inputs = payload.get("input", "")
+        texts = [inputs] if isinstance(inputs, str) else [str(text) for text in inputs[:1]]
+    except (ValueError, AttributeError, TypeError):
+        texts = []
+    return await proxy(request, _prefix_key(texts, settings.router_prefix_tokens))
@@ -1,14 +1,31 @@
 from abc import ABC, abstractmethod
-from typing import List, AsyncGenerator
-from app.models import Message
+from typing import List, AsyncGenerator, Optional, Union
+from app.models import Embedding, Generation, Message
 
 class BaseEngine(ABC):
     """abstract base class defining the LLM engine interface"""
     
+    # engines that implement embed() set this so the API can reject embedding requests up front
+    supports_embeddings = False
+    
     def __init__(self, model_name: str, **kwargs):
         self.model_name = model_name
         self.kwargs = kwargs
     
+    def _messages_to_prompt(self, messages: List[Message]) -> str:
+        """turn messages to prompt"""
+        prompt_parts = []
+        for msg in messages:
+            if msg.role == "system":
+                prompt_parts.append(f"System: {msg.content}")
+            elif msg.role == "user":
+                prompt_parts.append(f"User: {msg.content}")
+            elif msg.role == "assistant":
+                prompt_parts.append(f"Assistant: {msg.content}")
+        
+        prompt_parts.append("Assistant:")
+        return "\n".join(prompt_parts)
+    
     @abstractmethod
     async def initialize(self):
         """init the engine (load the model, etc.)"""
@@ -20,7 +37,9 @@ class BaseEngine(ABC):
         messages: List[Message],
         temperature: float = 0.7,
         max_tokens: int = 512,
-    ) -> str:
+        stop: Optional[Union[str, List[str]]] = None,
+        adapter: Optional[str] = None,
+    ) -> Generation:
         """generate a response (non-streaming)"""
         pass
     
@@ -30,10 +49,16 @@ class BaseEngine(ABC):
         messages: List[Message],
         temperature: float = 0.7,
         max_tokens: int = 512,
-    ) -> AsyncGenerator[str, None]:
-        """generate a response (streaming)"""
+        stop: Optional[Union[str, List[str]]] = None,
+        adapter: Optional[str] = None,
+    ) -> AsyncGenerator[Generation, None]:
+        """generate a response (streaming), the last chunk carries the finish reason"""
         pass
     
+    async def embed(self, texts: List[str]) -> List[Embedding]:
+        """compute one embedding vector (and its token count) per input text"""
+        raise NotImplementedError(f"{type(self).__name__} does not support embeddings")
+    
     @abstractmethod
     async def shutdown(self):
         """clean up resources"""
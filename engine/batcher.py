@@ -0,0 +1,92 @@
+import asyncio
+from typing import Any, Callable, List, Optional, Tuple
+
+from middleware.metrics import record_batch_metrics
+
+class MicroBatcher:
+    """collects concurrent requests for a few milliseconds and runs them as one batch"""
+    
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        batch_type: str = "default",
+    ):
+        # batch_fn runs in the thread pool and must return one result per item, in order
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.batch_type = batch_type
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+    
+    def start(self):
+        """start the background batching loop (must be called from the event loop)"""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+    
+    async def submit(self, item: Any) -> Any:
+        """enqueue a single item and wait for its result"""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+    
+    async def _collect(self) -> List[Tuple[Any, asyncio.Future]]:
+        """wait for the first item, then keep collecting until the batch is full or max_wait expires"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        # drop items whose callers have already gone away
+        return [(item, future) for item, future in batch if not future.done()]
+    
+    async def _run(self):
+        """batching loop: one batch in flight at a time"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            
+            record_batch_metrics(self.batch_type, len(batch))
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(None, self.batch_fn, items)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+    
+    async def shutdown(self):
+        """stop the batching loop and fail any pending requests"""
+        if self._worker is None:
+            return
+        
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Batcher is shutting down"))
+        self._worker = None
@@ -0,0 +1,165 @@
+from typing import Callable, Collection, List, Optional, Set, Tuple, Union
+import torch
+
+# tokens of prompt context the detokenizer keeps so the first generated token decodes with correct spacing
+_CONTEXT_TOKENS = 5
+
+def sample_next_token(logits: torch.Tensor, temperature: float, top_k: Optional[int] = None) -> int:
+    """pick the next token from last-position logits (greedy when temperature is 0)"""
+    if temperature <= 0:
+        return int(torch.argmax(logits))
+
+    logits = logits / temperature
+    if top_k:
+        kth_largest = torch.topk(logits, min(top_k, logits.size(-1))).values[-1]
+        logits = logits.masked_fill(logits < kth_largest, float("-inf"))
+    probs = torch.softmax(logits, dim=-1)
+    return int(torch.multinomial(probs, num_samples=1))
+
+def fit_to_context(prompt_ids: List[int], max_tokens: int, max_positions: Optional[int]) -> Tuple[List[int], int]:
+    """left-truncate prompts that overflow the model window and cap max_tokens to the room left"""
+    if max_positions is None:
+        return prompt_ids, max_tokens
+    # keep the most recent context, leaving room for at least one new token
+    prompt_ids = prompt_ids[-(max_positions - 1):]
+    return prompt_ids, max(1, min(max_tokens, max_positions - len(prompt_ids)))
+
+def eos_token_ids(tokenizer, generation_config=None) -> Set[int]:
+    """ids that end generation: the tokenizer's EOS plus the generation config's, which may be a list (end-of-turn ids)"""
+    configured = getattr(generation_config, "eos_token_id", None)
+    ids = {tokenizer.eos_token_id}
+    ids.update(configured if isinstance(configured, (list, tuple)) else [configured])
+    return {token_id for token_id in ids if token_id is not None}
+
+class IncrementalDetokenizer:
+    """decodes generated tokens as they arrive, only re-decoding a small trailing window"""
+
+    def __init__(self, tokenizer, prompt_ids: List[int]):
+        self.tokenizer = tokenizer
+        self.tokens = list(prompt_ids[-_CONTEXT_TOKENS:])
+        # tokens[prefix_offset:read_offset] were already emitted and give context for the next ones
+        self.prefix_offset = 0
+        self.read_offset = len(self.tokens)
+
+    def add(self, token_id: int) -> str:
+        """append a token and return the newly completed text (may be empty)"""
+        self.tokens.append(token_id)
+        prefix_text = self.tokenizer.decode(
+            self.tokens[self.prefix_offset:self.read_offset], skip_special_tokens=True
+        )
+        new_text = self.tokenizer.decode(
+            self.tokens[self.prefix_offset:], skip_special_tokens=True
+        )
+
+        # hold back incomplete multi-byte characters until the next token completes them
+        if len(new_text) > len(prefix_text) and not new_text.endswith("�"):
+            self.prefix_offset = self.read_offset
+            self.read_offset = len(self.tokens)
+            return new_text[len(prefix_text):]
+        return ""
+
+    def flush(self) -> str:
+        """release text held back for incomplete characters once the sequence ends"""
+        prefix_text = self.tokenizer.decode(
+            self.tokens[self.prefix_offset:self.read_offset], skip_special_tokens=True
+        )
+        new_text = self.tokenizer.decode(
+            self.tokens[self.prefix_offset:], skip_special_tokens=True
+        )
+        self.prefix_offset = self.read_offset = len(self.tokens)
+        return new_text[len(prefix_text):]
+
+class StopMatcher:
+    """finds stop strings in streamed text, holding back output that may be the start of one"""
+
+    def __init__(self, stop: Optional[List[str]] = None):
+        self.stop = [s for s in (stop or []) if s]
+        self.pending = ""
+
+    def feed(self, text: str) -> Tuple[str, bool]:
+        """returns (text safe to emit, whether a stop string was hit)"""
+        if not self.stop:
+            return text, False
+
+        # pending is shorter than the longest stop string, so this stays O(len(text))
+        self.pending += text
+        hits = [i for i in (self.pending.find(s) for s in self.stop) if i != -1]
+        if hits:
+            emit = self.pending[:min(hits)]
+            self.pending = ""
+            return emit, True
+
+        hold = self._partial_match_length()
+        emit = self.pending[:len(self.pending) - hold]
+        self.pending = self.pending[len(self.pending) - hold:]
+        return emit, False
+
+    def _partial_match_length(self) -> int:
+        """length of the longest suffix of pending that is a proper prefix of a stop string"""
+        for length in range(min(len(self.pending), max(len(s) for s in self.stop) - 1), 0, -1):
+            suffix = self.pending[-length:]
+            if any(s.startswith(suffix) for s in self.stop):
+                return length
+        return 0
+
+    def flush(self) -> str:
+        """release held-back text once the sequence ends without a stop"""
+        text, self.pending = self.pending, ""
+        return text
+
+class Sequence:
+    """decoding state of one request: incremental detokenization, stop matching and finish reason"""
+
+    def __init__(
+        self,
+        tokenizer,
+        prompt_ids: List[int],
+        temperature: float = 0.7,
+        max_tokens: int = 512,
+        stop: Optional[Union[str, List[str]]] = None,
+        on_delta: Optional[Callable[[str], None]] = None,
+        adapter=None,
+        eos_token_ids: Optional[Collection[int]] = None,
+    ):
+        self.prompt_ids = prompt_ids
+        self.adapter = adapter  # LoRA adapter applied to this row, None for the base model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.eos_token_ids = set(eos_token_ids) if eos_token_ids is not None else {tokenizer.eos_token_id}
+        self.on_delta = on_delta
+
+        self.detokenizer = IncrementalDetokenizer(tokenizer, prompt_ids)
+        self.stop_matcher = StopMatcher([stop] if isinstance(stop, str) else stop)
+        self.output_ids: List[int] = []
+        self.text = ""
+        self.finish_reason: Optional[str] = None  # 'stop' or 'length'
+        self.cancelled = False  # set when the client goes away
+
+    @property
+    def finished(self) -> bool:
+        return self.finish_reason is not None or self.cancelled
+
+    def append(self, token_id: int) -> str:
+        """add a sampled token, returns the newly visible text"""
+        self.output_ids.append(token_id)
+
+        if token_id in self.eos_token_ids:
+            delta, stopped = self.stop_matcher.feed(self.detokenizer.flush())
+            delta += "" if stopped else self.stop_matcher.flush()
+            self.finish_reason = "stop"
+        else:
+            delta, stopped = self.stop_matcher.feed(self.detokenizer.add(token_id))
+            if stopped:
+                self.finish_reason = "stop"
+            elif len(self.output_ids) >= self.max_tokens:
+                tail, stopped = self.stop_matcher.feed(self.detokenizer.flush())
+                delta += tail if stopped else tail + self.stop_matcher.flush()
+                self.finish_reason = "stop" if stopped else "length"
+
+        # responses never start with the whitespace separating them from the prompt
+        if not self.text:
+            delta = delta.lstrip()
+        self.text += delta
+        if delta and self.on_delta is not None:
+            self.on_delta(delta)
+        return delta
@@ -0,0 +1,92 @@
+import asyncio
+import hashlib
+from typing import List, AsyncGenerator, Optional, Union
+from app.models import Embedding, Generation, Message
+from .base import BaseEngine
+from .decoding import StopMatcher
+from .lora import AdapterNotFoundError
+
+class FakeEngine(BaseEngine):
+    """model-free engine for tests and router setups: echoes the last message back one word per step"""
+
+    supports_embeddings = True
+
+    def __init__(self, model_name: str = "fake", token_delay_ms: float = 0.0, **kwargs):
+        super().__init__(model_name, **kwargs)
+        self.token_delay = token_delay_ms / 1000.0
+
+    async def initialize(self):
+        """nothing to load"""
+        print(f"Fake engine ready ({self.token_delay * 1000:.0f}ms per token)")
+
+    async def generate(
+        self,
+        messages: List[Message],
+        temperature: float = 0.7,
+        max_tokens: int = 512,
+        stop: Optional[Union[str, List[str]]] = None,
+        adapter: Optional[str] = None,
+    ) -> Generation:
+        """generate response"""
+        chunks = []
+        async for chunk in self.generate_stream(messages, temperature, max_tokens, stop, adapter):
+            chunks.append(chunk)
+        return Generation(
+            text="".join(chunk.text for chunk in chunks).strip(),
+            finish_reason=chunks[-1].finish_reason,
+            prompt_tokens=chunks[-1].prompt_tokens,
+            completion_tokens=chunks[-1].completion_tokens,
+        )
+
+    async def generate_stream(
+        self,
+        messages: List[Message],
+        temperature: float = 0.7,
+        max_tokens: int = 512,
+        stop: Optional[Union[str, List[str]]] = None,
+        adapter: Optional[str] = None,
+    ) -> AsyncGenerator[Generation, None]:
+        """stream the words of the last message (repeated up to max_tokens), pausing token_delay_ms per word"""
+        if adapter is not None:
+            raise AdapterNotFoundError(f"Adapter not found: {adapter}")
+
+        prompt_words = self._messages_to_prompt(messages).split()
+        words = (messages[-1].content.split() if messages else []) or ["fake"]
+        matcher = StopMatcher([stop] if isinstance(stop, str) else stop)
+
+        finish_reason = "length"
+        completion_tokens = 0
+        for step in range(max_tokens):
+            await asyncio.sleep(self.token_delay)
+            completion_tokens += 1
+            text, stopped = matcher.feed(("" if step == 0 else " ") + words[step % len(words)])
+            if text:
+                yield Generation(text=text)
+            if stopped:
+                finish_reason = "stop"
+                break
+        else:
+            tail = matcher.flush()
+            if tail:
+                yield Generation(text=tail)
+
+        yield Generation(
+            text="",
+            finish_reason=finish_reason,
+            prompt_tokens=len(prompt_words),
+            completion_tokens=completion_tokens,
+        )
+
+    async def embed(self, texts: List[str]) -> List[Embedding]:
+        """deterministic unit vectors derived from a hash of the text"""
+        results = []
+        for text in texts:
+            digest = hashlib.sha256(text.encode("utf-8")).digest()
+            vector = [byte / 255.0 - 0.5 for byte in digest[:16]]
+            norm = sum(x * x for x in vector) ** 0.5 or 1.0
+            results.append(Embedding(embedding=[x / norm for x in vector], prompt_tokens=len(text.split())))
+        return results
+
+    async def shutdown(self):
+        """clean up resources"""
+        print("Engine shutdown complete")
@@ -0,0 +1,228 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import torch
+from torch import nn
+from transformers.pytorch_utils import Conv1D
+
+from middleware.metrics import record_adapter_cache, record_adapter_load, set_adapter_residency
+
+class AdapterNotFoundError(ValueError):
+    """the requested adapter does not exist (or adapters are disabled)"""
+
+class UnsupportedAdapterError(ValueError):
+    """the adapter uses PEFT features this server cannot apply (or the engine serves no adapters)"""
+
+class LoRAAdapter:
+    """low-rank weights of one PEFT LoRA adapter, keyed by base module name"""
+
+    def __init__(self, name: str, weights: Dict[str, Tuple[torch.Tensor, torch.Tensor, float]]):
+        self.name = name
+        self.weights = weights  # module name -> (A: r x in, B: out x r, scaling)
+        self.nbytes = sum(
+            a.numel() * a.element_size() + b.numel() * b.element_size()
+            for a, b, _ in weights.values()
+        )
+
+def _pattern_value(patterns: Dict[str, float], module_name: str, default: float) -> float:
+    """per-module override from a PEFT rank/alpha pattern (first key matching the end of the module name)"""
+    for key, value in patterns.items():
+        if re.match(rf"(.*\.)?({key})$", module_name):
+            return value
+    return default
+
+def _check_supported(name: str, config: dict, state_dict: Dict[str, torch.Tensor]):
+    """reject adapters whose output would differ from PEFT's if only the low-rank deltas were applied"""
+    if config.get("peft_type", "LORA") != "LORA":
+        raise UnsupportedAdapterError(f"Adapter {name} is a {config['peft_type']} adapter, only LoRA is supported")
+    if config.get("use_dora"):
+        raise UnsupportedAdapterError(f"Adapter {name} uses DoRA, which is not supported")
+    if config.get("bias", "none") != "none":
+        raise UnsupportedAdapterError(f"Adapter {name} trains biases (bias={config['bias']!r}), which is not supported")
+    if config.get("modules_to_save"):
+        raise UnsupportedAdapterError(
+            f"Adapter {name} fully trains modules_to_save ({', '.join(config['modules_to_save'])}), which is not supported"
+        )
+
+    # anything else stored in the checkpoint (e.g. embedding LoRA) would be silently ignored
+    unknown = [key for key in state_dict if ".lora_A." not in key and ".lora_B." not in key]
+    if unknown:
+        raise UnsupportedAdapterError(f"Adapter {name} has weights other than LoRA A/B: {', '.join(unknown[:3])}")
+
+def load_adapter(name: str, path: str) -> LoRAAdapter:
+    """read a PEFT adapter directory (adapter_config.json + adapter_model.safetensors/.bin)"""
+    with open(os.path.join(path, "adapter_config.json")) as f:
+        config = json.load(f)
+
+    safetensors_path = os.path.join(path, "adapter_model.safetensors")
+    if os.path.exists(safetensors_path):
+        from safetensors.torch import load_file
+        state_dict = load_file(safetensors_path)
+    else:
+        state_dict = torch.load(os.path.join(path, "adapter_model.bin"), map_location="cpu", weights_only=True)
+    _check_supported(name, config, state_dict)
+
+    # keys look like base_model.model.<module>.lora_A[.<adapter>].weight
+    lora_a, lora_b = {}, {}
+    for key, tensor in state_dict.items():
+        for marker, target in ((".lora_A.", lora_a), (".lora_B.", lora_b)):
+            if marker in key:
+                module_name = key.split(marker)[0]
+                module_name = module_name.removeprefix("base_model.model.")
+                target[module_name] = tensor.to(torch.float32)
+
+    rank_pattern = config.get("rank_pattern") or {}
+    alpha_pattern = config.get("alpha_pattern") or {}
+    weights = {}
+    for module in lora_a:
+        if module not in lora_b:
+            continue
+        # rank_pattern / alpha_pattern override r and lora_alpha per module, as in PEFT
+        rank = _pattern_value(rank_pattern, module, config.get("r", lora_a[module].shape[0]))
+        alpha = _pattern_value(alpha_pattern, module, config.get("lora_alpha", rank))
+        scaling = alpha / (rank ** 0.5) if config.get("use_rslora") else alpha / rank
+        weights[module] = (lora_a[module], lora_b[module], scaling)
+    if not weights:
+        raise ValueError(f"Adapter {name} has no LoRA weights")
+    return LoRAAdapter(name, weights)
+
+class LoRALinear(nn.Module):
+    """base linear layer plus per-row low-rank deltas for whichever adapters the current batch uses"""
+
+    def __init__(self, base: nn.Module, name: str, manager: "LoRAManager"):
+        super().__init__()
+        self.base = base
+        self.name = name
+        self.manager = manager
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        out = self.base(x)
+        for adapter, rows in self.manager.active_adapters():
+            weights = adapter.weights.get(self.name)
+            if weights is None:
+                continue
+            lora_a, lora_b, scaling = weights
+            delta = (x.index_select(0, rows) @ lora_a.t() @ lora_b.t()) * scaling
+            out.index_add_(0, rows, delta.to(out.dtype))
+        return out
+
+class LoRAManager:
+    """LRU cache of adapters loaded on demand on top of shared base weights"""
+
+    def __init__(self, model: nn.Module, adapter_dir: Optional[str] = None, max_adapters: int = 8):
+        self.model = model
+        self.adapter_dir = adapter_dir
+        self.max_adapters = max(1, max_adapters)
+        self._adapters: "OrderedDict[str, LoRAAdapter]" = OrderedDict()
+        self._loading: Dict[str, Future] = {}  # adapter name -> load in progress
+        self._lock = threading.Lock()
+        # the batch layout is per thread so concurrent forward passes (e.g. embeddings) stay adapter-free
+        self._local = threading.local()
+
+    def get_resident(self, name: str) -> Optional[LoRAAdapter]:
+        """cache lookup only (cheap enough to call from the event loop), None when not resident"""
+        with self._lock:
+            adapter = self._adapters.get(name)
+            if adapter is not None:
+                self._adapters.move_to_end(name)
+                record_adapter_cache("hit")
+            return adapter
+
+    def get(self, name: str) -> LoRAAdapter:
+        """return a resident adapter, loading (and evicting the least recently used) on a miss
+
+        the disk load runs outside the lock so other adapters stay available meanwhile;
+        concurrent misses for the same name wait for a single load
+        """
+        adapter = self.get_resident(name)
+        if adapter is not None:
+            return adapter
+
+        path = self._resolve(name)
+        with self._lock:
+            # loaded by another thread since the lookup above
+            adapter = self._adapters.get(name)
+            if adapter is not None:
+                self._adapters.move_to_end(name)
+                record_adapter_cache("hit")
+                return adapter
+
+            loading = self._loading.get(name)
+            owner = loading is None
+            if owner:
+                loading = self._loading[name] = Future()
+        record_adapter_cache("miss")
+        if not owner:
+            return loading.result()
+
+        try:
+            start_time = time.time()
+            adapter = load_adapter(name, path)
+            with self._lock:
+                self._wrap_modules(adapter)
+                self._adapters[name] = adapter
+                while len(self._adapters) > self.max_adapters:
+                    self._adapters.popitem(last=False)
+                set_adapter_residency(
+                    len(self._adapters),
+                    sum(a.nbytes for a in self._adapters.values())
+                )
+            record_adapter_load(time.time() - start_time)
+            loading.set_result(adapter)
+            return adapter
+        except Exception as e:
+            loading.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._loading[name]
+
+    def _resolve(self, name: str) -> str:
+        """map an adapter name onto a directory under adapter_dir"""
+        if self.adapter_dir is None:
+            raise AdapterNotFoundError("LoRA adapters are not enabled (set LORA_ADAPTER_DIR)")
+        if not name or name != os.path.basename(name) or name in (".", ".."):
+            raise AdapterNotFoundError(f"Invalid adapter name: {name}")
+
+        path = os.path.join(self.adapter_dir, name)
+        if not os.path.isfile(os.path.join(path, "adapter_config.json")):
+            raise AdapterNotFoundError(f"Adapter not found: {name}")
+        return path
+
+    def _wrap_modules(self, adapter: LoRAAdapter):
+        """wrap every base module the adapter targets (once; wrappers are no-ops without an active adapter)"""
+        for module_name in adapter.weights:
+            module = self.model.get_submodule(module_name)
+            if isinstance(module, LoRALinear):
+                continue
+            if not isinstance(module, (nn.Linear, Conv1D)):
+                raise UnsupportedAdapterError(f"Adapter {adapter.name} targets unsupported module {module_name}")
+
+            parent_name, _, child_name = module_name.rpartition(".")
+            parent = self.model.get_submodule(parent_name) if parent_name else self.model
+            setattr(parent, child_name, LoRALinear(module, module_name, self))
+
+    def set_batch(self, adapters: List[Optional[LoRAAdapter]]):
+        """declare which adapter each batch row uses for forward passes on this thread"""
+        rows_by_adapter = OrderedDict()
+        for row, adapter in enumerate(adapters):
+            if adapter is not None:
+                # by identity: an evicted adapter still used by running rows may share its name with a reloaded one
+                rows_by_adapter.setdefault(id(adapter), (adapter, []))[1].append(row)
+
+        self._local.active = [
+            (adapter, torch.tensor(rows, dtype=torch.long))
+            for adapter, rows in rows_by_adapter.values()
+        ]
+
+    def clear_batch(self):
+        self._local.active = []
+
+    def active_adapters(self) -> List[Tuple[LoRAAdapter, torch.Tensor]]:
+        return getattr(self._local, "active", [])
@@ -0,0 +1,273 @@
+import asyncio
+import queue
+import threading
+from typing import List, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+
+from middleware.metrics import record_batch_metrics
+from .decoding import Sequence, sample_next_token
+
+def _cache_layers(past_key_values) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """(key, value) per layer, each (batch, heads, seq_len, head_dim), for every KV cache format"""
+    if isinstance(past_key_values, tuple):
+        return [(layer[0], layer[1]) for layer in past_key_values]
+    if hasattr(past_key_values, "layers"):
+        return [(layer.keys, layer.values) for layer in past_key_values.layers]
+    return list(zip(past_key_values.key_cache, past_key_values.value_cache))
+
+def _replace_cache_layers(past_key_values, layers: List[Tuple[torch.Tensor, torch.Tensor]]):
+    """swap the per-layer tensors of a KV cache, keeping its format"""
+    if isinstance(past_key_values, tuple):
+        return tuple(layers)
+    if hasattr(past_key_values, "layers"):
+        for layer, (key, value) in zip(past_key_values.layers, layers):
+            layer.keys, layer.values = key, value
+    else:
+        past_key_values.key_cache[:] = [key for key, _ in layers]
+        past_key_values.value_cache[:] = [value for _, value in layers]
+    return past_key_values
+
+def _left_pad(tensor: torch.Tensor, length: int, dim: int) -> torch.Tensor:
+    """zero-pad a tensor on the left of dim up to length"""
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    # F.pad lists (left, right) pairs starting from the last dimension
+    padding = [0, 0] * (tensor.dim() - 1 - dim % tensor.dim()) + [missing, 0]
+    return F.pad(tensor, padding)
+
+class _Batch:
+    """rows being decoded together: their KV cache, attention mask and next input tokens"""
+
+    def __init__(self, entries, past_key_values, attention_mask: torch.Tensor, next_tokens: List[int]):
+        self.entries = entries  # (sequence, future, loop) per row
+        self.past_key_values = past_key_values
+        self.attention_mask = attention_mask
+        self.next_tokens = next_tokens
+
+    def keep(self, rows: List[int]):
+        """drop every row not listed, then cut cache columns that are padding for all remaining rows"""
+        if len(rows) < len(self.entries):
+            index = torch.tensor(rows, dtype=torch.long, device=self.attention_mask.device)
+            self.past_key_values = _replace_cache_layers(self.past_key_values, [
+                (key.index_select(0, index), value.index_select(0, index))
+                for key, value in _cache_layers(self.past_key_values)
+            ])
+            self.attention_mask = self.attention_mask.index_select(0, index)
+            self.entries = [self.entries[row] for row in rows]
+            self.next_tokens = [self.next_tokens[row] for row in rows]
+
+        if not self.entries:
+            return
+        # left padding that only finished rows needed
+        first = int(self.attention_mask.any(dim=0).int().argmax())
+        if first > 0:
+            self.past_key_values = _replace_cache_layers(self.past_key_values, [
+                (key[:, :, first:], value[:, :, first:])
+                for key, value in _cache_layers(self.past_key_values)
+            ])
+            self.attention_mask = self.attention_mask[:, first:]
+
+    def merge(self, other: "_Batch"):
+        """append the rows of another batch, left-padding whichever cache is shorter"""
+        length = max(self.attention_mask.shape[1], other.attention_mask.shape[1])
+        self.past_key_values = _replace_cache_layers(self.past_key_values, [
+            (
+                torch.cat([_left_pad(key, length, -2), _left_pad(other_key, length, -2)]),
+                torch.cat([_left_pad(value, length, -2), _left_pad(other_value, length, -2)]),
+            )
+            for (key, value), (other_key, other_value) in zip(
+                _cache_layers(self.past_key_values), _cache_layers(other.past_key_values)
+            )
+        ])
+        self.attention_mask = torch.cat(
+            [_left_pad(self.attention_mask, length, 1), _left_pad(other.attention_mask, length, 1)]
+        )
+        self.entries += other.entries
+        self.next_tokens += other.next_tokens
+
+class ContinuousBatcher:
+    """continuous batching: queued sequences join the running decode batch at the next step boundary
+
+    a background thread owns the batch; new sequences are prefilled together and merged into it,
+    finished ones (EOS, stop string, max_tokens or cancelled) leave it right away, so a long
+    generation never holds up short ones and freed rows are reused immediately
+    """
+
+    def __init__(self, model, pad_token_id: int, lora=None, max_batch_size: int = 8, device: str = "cpu"):
+        self.model = model
+        self.pad_token_id = pad_token_id
+        self.lora = lora
+        self.max_batch_size = max(1, max_batch_size)
+        self.device = device
+        self.top_k = getattr(model.generation_config, "top_k", None)
+        self._waiting: "queue.Queue" = queue.Queue()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        """start the decode thread"""
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="continuous-batcher", daemon=True)
+            self._thread.start()
+
+    async def submit(self, sequence: Sequence) -> Sequence:
+        """queue a sequence and wait until it has finished decoding"""
+        self.start()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiting.put((sequence, future, loop))
+        return await future
+
+    def _run(self):
+        """decode loop: admit waiting sequences, then advance every running row by one token"""
+        batch: Optional[_Batch] = None
+        # checked every step so shutdown does not wait for a full batch to finish decoding
+        while not self._stopping.is_set():
+            running = len(batch.entries) if batch else 0
+            admitted = self._admit(block=running == 0, limit=self.max_batch_size - running)
+            if admitted is None:
+                break
+
+            try:
+                if admitted:
+                    prefilled = self._prefill(admitted)
+                    if batch is None:
+                        batch = prefilled
+                    elif prefilled is not None:
+                        batch.merge(prefilled)
+            except Exception as e:
+                # only the newcomers are affected, the running batch is untouched until merged
+                for entry in admitted:
+                    self._finish(entry, e)
+
+            try:
+                if batch is not None:
+                    self._step(batch)
+            except Exception as e:
+                # the batch state is unusable after a failed forward pass, fail every row in it
+                for entry in batch.entries:
+                    self._finish(entry, e)
+                batch = None
+            finally:
+                if self.lora is not None:
+                    self.lora.clear_batch()
+
+            if batch is not None and not batch.entries:
+                batch = None
+
+        for entry in batch.entries if batch else []:
+            self._finish(entry, RuntimeError("Engine is shutting down"))
+
+    def _admit(self, block: bool, limit: int):
+        """take up to limit live sequences off the queue (waiting for one when idle), None on shutdown"""
+        admitted = []
+        while len(admitted) < limit:
+            try:
+                entry = self._waiting.get(block=block and not admitted)
+            except queue.Empty:
+                break
+            if entry is None:
+                for pending in admitted:
+                    self._finish(pending, RuntimeError("Engine is shutting down"))
+                return None
+            # requests abandoned while queued never enter the batch
+            if entry[0].cancelled or entry[1].done():
+                self._finish(entry)
+                continue
+            admitted.append(entry)
+        return admitted
+
+    def _forward(self, entries, input_ids: torch.Tensor, attention_mask: torch.Tensor, past_key_values=None):
+        """one forward pass, returns (last-position logits, KV cache)"""
+        if self.lora is not None:
+            self.lora.set_batch([sequence.adapter for sequence, _, _ in entries])
+        record_batch_metrics("generation", len(entries))
+
+        position_ids = (attention_mask.cumsum(dim=-1) - 1).clamp(min=0)
+        position_ids = position_ids[:, -input_ids.shape[1]:]
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=input_ids.to(self.device),
+                attention_mask=attention_mask.to(self.device),
+                position_ids=position_ids.to(self.device),
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+        return outputs.logits[:, -1, :], outputs.past_key_values
+
+    def _prefill(self, entries) -> Optional[_Batch]:
+        """run the prompts of newly admitted sequences and sample their first token"""
+        # left-pad prompts so the last column holds every row's newest token
+        max_len = max(len(sequence.prompt_ids) for sequence, _, _ in entries)
+        input_ids = torch.tensor(
+            [[self.pad_token_id] * (max_len - len(seq.prompt_ids)) + seq.prompt_ids for seq, _, _ in entries],
+            dtype=torch.long,
+        )
+        attention_mask = torch.tensor(
+            [[0] * (max_len - len(seq.prompt_ids)) + [1] * len(seq.prompt_ids) for seq, _, _ in entries],
+            dtype=torch.long,
+        )
+
+        logits, past_key_values = self._forward(entries, input_ids, attention_mask)
+        batch = _Batch(list(entries), past_key_values, attention_mask, [0] * len(entries))
+        self._sample(batch, logits)
+        return batch if batch.entries else None
+
+    def _step(self, batch: _Batch):
+        """feed every row its latest token and sample the next one"""
+        batch.attention_mask = torch.cat(
+            [batch.attention_mask, torch.ones((len(batch.entries), 1), dtype=torch.long)], dim=-1
+        )
+        input_ids = torch.tensor(batch.next_tokens, dtype=torch.long).unsqueeze(-1)
+        logits, batch.past_key_values = self._forward(
+            batch.entries, input_ids, batch.attention_mask, batch.past_key_values
+        )
+        self._sample(batch, logits)
+
+    def _sample(self, batch: _Batch, logits: torch.Tensor):
+        """append one token per row, then release finished rows from the batch"""
+        keep = []
+        for row, entry in enumerate(batch.entries):
+            sequence = entry[0]
+            if not sequence.cancelled:
+                batch.next_tokens[row] = sample_next_token(logits[row], sequence.temperature, self.top_k)
+                sequence.append(batch.next_tokens[row])
+            if sequence.finished:
+                self._finish(entry)
+            else:
+                keep.append(row)
+        batch.keep(keep)
+
+    @staticmethod
+    def _finish(entry, error: Optional[BaseException] = None):
+        """resolve the waiting caller's future from the decode thread"""
+        sequence, future, loop = entry
+
+        def resolve():
+            if future.done():
+                return
+            if error is None:
+                future.set_result(sequence)
+            else:
+                future.set_exception(error)
+
+        loop.call_soon_threadsafe(resolve)
+
+    async def shutdown(self):
+        """stop the decode thread, failing queued and running sequences"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        # wakes the decode thread if it is idle, waiting for a sequence
+        self._waiting.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+        self._thread = None
+
+        while not self._waiting.empty():
+            entry = self._waiting.get_nowait()
+            if entry is not None:
+                self._finish(entry, RuntimeError("Engine is shutting down"))
@@ -1,18 +1,53 @@
 import asyncio
-from typing import List, AsyncGenerator
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from typing import List, AsyncGenerator, Optional, Union
+from transformers import AutoTokenizer, AutoModel, AutoModelForCausalLM
 import torch
-from app.models import Message
+from app.models import Embedding, Generation, Message
 from .base import BaseEngine
+from .batcher import MicroBatcher
+from .decoding import Sequence, eos_token_ids, fit_to_context
+from .lora import LoRAAdapter, LoRAManager
+from .scheduler import ContinuousBatcher
 
 class SimpleEngine(BaseEngine):
     """simple engine based on Hugging Face Transformers for CPU mode"""
     
-    def __init__(self, model_name: str = "gpt2", **kwargs):
+    supports_embeddings = True
+    
+    def __init__(
+        self,
+        model_name: str = "gpt2",
+        embedding_model_name: Optional[str] = None,
+        embedding_max_batch_size: int = 32,
+        embedding_max_wait_ms: float = 5.0,
+        generation_max_batch_size: int = 8,
+        lora_adapter_dir: Optional[str] = None,
+        lora_max_adapters: int = 8,
+        **kwargs
+    ):
         super().__init__(model_name, **kwargs)
         self.tokenizer = None
         self.model = None
         self.device = "cpu"  # CPU mode
+        
+        # embeddings reuse the causal LM unless a dedicated encoder is configured
+        self.embedding_model_name = embedding_model_name or model_name
+        self.embedding_tokenizer = None
+        self.embedding_model = None
+        self.embedding_batcher = MicroBatcher(
+            self._embed_sync,
+            max_batch_size=embedding_max_batch_size,
+            max_wait_ms=embedding_max_wait_ms,
+            batch_type="embedding",
+        )
+        
+        # concurrent generations (with any mix of LoRA adapters) share forward passes,
+        # the batcher is created once the model is loaded
+        self.generation_max_batch_size = generation_max_batch_size
+        self.generation_batcher = None
+        self.lora_adapter_dir = lora_adapter_dir
+        self.lora_max_adapters = lora_max_adapters
+        self.lora = None
     
     async def initialize(self):
         """load model in background"""
@@ -23,6 +58,25 @@ class SimpleEngine(BaseEngine):
         self.tokenizer, self.model = await loop.run_in_executor(
             None, self._load_model
         )
+        
+        if self.embedding_model_name != self.model_name:
+            print(f"Loading embedding model: {self.embedding_model_name}")
+            self.embedding_tokenizer, self.embedding_model = await loop.run_in_executor(
+                None, self._load_embedding_model
+            )
+        else:
+            self.embedding_tokenizer, self.embedding_model = self.tokenizer, self.model
+        
+        self.lora = LoRAManager(self.model, self.lora_adapter_dir, self.lora_max_adapters)
+        self.generation_batcher = ContinuousBatcher(
+            self.model,
+            self.tokenizer.pad_token_id,
+            lora=self.lora,
+            max_batch_size=self.generation_max_batch_size,
+            device=self.device,
+        )
+        self.embedding_batcher.start()
+        self.generation_batcher.start()
         print(f"Model loaded successfully")
     
     def _load_model(self):
@@ -41,76 +95,188 @@ class SimpleEngine(BaseEngine):
             
         return tokenizer, model
     
-    def _messages_to_prompt(self, messages: List[Message]) -> str:
-        """turn messages to prompt"""
-        prompt_parts = []
-        for msg in messages:
-            if msg.role == "system":
-                prompt_parts.append(f"System: {msg.content}")
-            elif msg.role == "user":
-                prompt_parts.append(f"User: {msg.content}")
-            elif msg.role == "assistant":
-                prompt_parts.append(f"Assistant: {msg.content}")
-        
-        prompt_parts.append("Assistant:")
-        return "\n".join(prompt_parts)
+    def _load_embedding_model(self):
+        """func to load a dedicated encoder model in background"""
+        tokenizer = AutoTokenizer.from_pretrained(self.embedding_model_name)
+        model = AutoModel.from_pretrained(
+            self.embedding_model_name,
+            torch_dtype=torch.float32,
+        )
+        model.to(self.device)
+        model.eval()
+        
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        
+        return tokenizer, model
+    
+    def _new_sequence(
+        self,
+        messages: List[Message],
+        temperature: float,
+        max_tokens: int,
+        stop: Optional[Union[str, List[str]]],
+        adapter: Optional[LoRAAdapter] = None,
+        on_delta=None,
+    ) -> Sequence:
+        """tokenize the prompt and set up decoding state"""
+        prompt_ids = self.tokenizer(self._messages_to_prompt(messages))["input_ids"]
+        # never decode past the model's context window
+        prompt_ids, max_tokens = fit_to_context(
+            prompt_ids, max_tokens, getattr(self.model.config, "max_position_embeddings", None)
+        )
+        
+        return Sequence(
+            self.tokenizer,
+            prompt_ids,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stop=stop,
+            on_delta=on_delta,
+            adapter=adapter,
+            eos_token_ids=eos_token_ids(self.tokenizer, self.model.generation_config),
+        )
+    
+    async def _get_adapter(self, name: Optional[str]) -> Optional[LoRAAdapter]:
+        """resolve an adapter name, loading it in background on a cache miss"""
+        if name is None:
+            return None
+        # resident adapters are returned without a thread pool round trip
+        adapter = self.lora.get_resident(name)
+        if adapter is not None:
+            return adapter
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.lora.get, name)
     
     async def generate(
         self,
         messages: List[Message],
         temperature: float = 0.7,
         max_tokens: int = 512,
-    ) -> str:
+        stop: Optional[Union[str, List[str]]] = None,
+        adapter: Optional[str] = None,
+    ) -> Generation:
         """generate response"""
-        prompt = self._messages_to_prompt(messages)
+        lora_adapter = await self._get_adapter(adapter)
+        sequence = self._new_sequence(messages, temperature, max_tokens, stop, lora_adapter)
         
-        loop = asyncio.get_event_loop()
-        response = await loop.run_in_executor(
-            None,
-            self._generate_sync,
-            prompt,
-            temperature,
-            max_tokens
-        )
-        return response
-    
-    def _generate_sync(self, prompt: str, temperature: float, max_tokens: int) -> str:
-        """generate response synchronously in thread pool"""
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
-        
-        with torch.no_grad():
-            outputs = self.model.generate(
-                **inputs,
-                max_new_tokens=max_tokens,
-                temperature=temperature,
-                do_sample=temperature > 0,
-                pad_token_id=self.tokenizer.pad_token_id,
-            )
+        try:
+            await self.generation_batcher.submit(sequence)
+        except asyncio.CancelledError:
+            # caller went away: free the slot at the next decode step
+            sequence.cancelled = True
+            raise
         
-        response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        # only return new tokens
-        response = response[len(prompt):].strip()
-        return response
+        return Generation(
+            text=sequence.text.strip(),
+            finish_reason=sequence.finish_reason,
+            prompt_tokens=len(sequence.prompt_ids),
+            completion_tokens=len(sequence.output_ids),
+        )
     
     async def generate_stream(
         self,
         messages: List[Message],
         temperature: float = 0.7,
         max_tokens: int = 512,
-    ) -> AsyncGenerator[str, None]:
-        """streaming generate response"""
-        # simplified version: yield results in batches
-        response = await self.generate(messages, temperature, max_tokens)
-        
-        # Simulate streaming output (5 characters at a time)
-        chunk_size = 5
-        for i in range(0, len(response), chunk_size):
-            chunk = response[i:i + chunk_size]
-            yield chunk
-            await asyncio.sleep(0.05)  # simulate generation delay
+        stop: Optional[Union[str, List[str]]] = None,
+        adapter: Optional[str] = None,
+    ) -> AsyncGenerator[Generation, None]:
+        """streaming generate response, text is yielded as soon as it is decoded"""
+        loop = asyncio.get_event_loop()
+        deltas = asyncio.Queue()
+        lora_adapter = await self._get_adapter(adapter)
+        sequence = self._new_sequence(
+            messages, temperature, max_tokens, stop, lora_adapter,
+            on_delta=lambda text: loop.call_soon_threadsafe(deltas.put_nowait, text),
+        )
+        
+        task = asyncio.ensure_future(self.generation_batcher.submit(sequence))
+        task.add_done_callback(lambda _: deltas.put_nowait(None))
+        
+        try:
+            while True:
+                text = await deltas.get()
+                if text is None:
+                    break
+                yield Generation(text=text)
+            
+            await task  # surface decoding errors
+            yield Generation(
+                text="",
+                finish_reason=sequence.finish_reason,
+                prompt_tokens=len(sequence.prompt_ids),
+                completion_tokens=len(sequence.output_ids),
+            )
+        finally:
+            # client went away: free the slot at the next decode step
+            sequence.cancelled = True
+            task.cancel()
+    
+    async def embed(self, texts: List[str]) -> List[Embedding]:
+        """embed texts; concurrent calls are merged into shared forward passes"""
+        return await asyncio.gather(
+            *(self.embedding_batcher.submit(text) for text in texts)
+        )
+    
+    def _embedding_max_length(self) -> int:
+        """longest input the embedding model can attend to"""
+        config = self.embedding_model.config
+        max_positions = getattr(config, "max_position_embeddings", None) or getattr(config, "n_positions", None)
+        if max_positions is None:
+            return self.embedding_tokenizer.model_max_length
+        return min(max_positions, self.embedding_tokenizer.model_max_length)
+    
+    def _embed_sync(self, texts: List[str]) -> List[Embedding]:
+        """embed a batch synchronously in thread pool"""
+        tokenizer = self.embedding_tokenizer
+        max_length = self._embedding_max_length()
+        
+        encoded, token_counts = [], []
+        for text in texts:
+            input_ids = tokenizer(text, truncation=True, max_length=max_length)["input_ids"]
+            token_counts.append(len(input_ids))
+            # empty inputs still need one position to pool over
+            encoded.append(input_ids or [tokenizer.pad_token_id])
+        
+        # group by power-of-two length so short inputs are not padded to the longest one
+        buckets = {}
+        for i, input_ids in enumerate(encoded):
+            bucket = 1 << (len(input_ids) - 1).bit_length()
+            buckets.setdefault(bucket, []).append(i)
+        
+        embeddings = [None] * len(texts)
+        for indices in buckets.values():
+            batch = tokenizer.pad(
+                {"input_ids": [encoded[i] for i in indices]},
+                return_tensors="pt",
+            ).to(self.device)
+            
+            with torch.no_grad():
+                # base_model skips the LM head when reusing the causal LM
+                hidden = self.embedding_model.base_model(
+                    input_ids=batch["input_ids"],
+                    attention_mask=batch["attention_mask"],
+                ).last_hidden_state
+            
+            # mean pooling over non-padding positions, then L2 normalize
+            mask = batch["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1.0)
+            pooled = torch.nn.functional.normalize(pooled, p=2, dim=-1)
+            
+            for row, i in enumerate(indices):
+                embeddings[i] = Embedding(embedding=pooled[row].tolist(), prompt_tokens=token_counts[i])
+        
+        return embeddings
     
     async def shutdown(self):
         """clean up resources"""
+        if self.generation_batcher is not None:
+            await self.generation_batcher.shutdown()
+        await self.embedding_batcher.shutdown()
+        if self.embedding_model is not None and self.embedding_model is not self.model:
+            del self.embedding_model
+            del self.embedding_tokenizer
         if self.model is not None:
             del self.model
             del self.tokenizer
@@ -0,0 +1,475 @@
+import asyncio
+import glob
+import os
+import queue
+import socket
+from contextlib import contextmanager
+from typing import List, AsyncGenerator, Optional, Union
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+from safetensors import safe_open
+from torch import nn
+from transformers import AutoConfig, AutoTokenizer, AutoModelForCausalLM, GenerationConfig
+from transformers.pytorch_utils import Conv1D
+from app.models import Generation, Message
+from .base import BaseEngine
+from .decoding import Sequence, eos_token_ids, fit_to_context, sample_next_token
+from .lora import UnsupportedAdapterError
+
+# control block layout (int64 tensor in shared memory)
+_CMD, _PROMPT_LEN, _MAX_NEW_TOKENS, _NUM_GENERATED, _DONE, _CANCEL = range(6)
+_CMD_GENERATE, _CMD_SHUTDOWN = 1, 2
+
+# (column-parallel layers, row-parallel layer, attention block, splits fused into each column layer)
+# column layers keep their output sharded so every block needs a single all-reduce; attention is
+# split by head, so each shard runs attention for its own heads and holds 1/N of the KV cache
+_SHARD_RULES = [
+    (("gate_proj", "up_proj"), "down_proj", False, 1),   # llama / mistral / qwen MLP
+    (("c_fc",), "c_proj", False, 1),                     # gpt2 MLP
+    (("fc1",), "fc2", False, 1),                         # opt / phi MLP
+    (("dense_h_to_4h",), "dense_4h_to_h", False, 1),     # gpt-neox MLP
+    (("q_proj", "k_proj", "v_proj"), "o_proj", True, 1), # llama / mistral / qwen attention
+    (("q_proj", "k_proj", "v_proj"), "out_proj", True, 1),  # opt attention
+    (("c_attn",), "c_proj", True, 3),                    # gpt2 attention (q, k, v fused)
+]
+
+# head counts and widths attention modules read in forward (which ones depends on the transformers version)
+_HEAD_ATTRIBUTES = ("num_heads", "num_key_value_heads", "split_size", "embed_dim", "hidden_size")
+
+def _linear_shape(module: nn.Module):
+    """(out_features, in_features, has_bias) for both nn.Linear and gpt2 Conv1D"""
+    if isinstance(module, Conv1D):
+        in_features, out_features = module.weight.shape
+    else:
+        out_features, in_features = module.weight.shape
+    return out_features, in_features, module.bias is not None
+
+def _shard_ranges(size: int, rank: int, world_size: int, splits: int = 1):
+    """[start, end) ranges of this rank's part of each of the fused splits"""
+    split = size // splits
+    shard = split // world_size
+    return [(i * split + rank * shard, i * split + (rank + 1) * shard) for i in range(splits)]
+
+class ColumnParallelLinear(nn.Module):
+    """holds a slice of the output features of a linear layer, the output stays sharded"""
+
+    def __init__(self, module: nn.Module, rank: int, world_size: int, splits: int = 1):
+        super().__init__()
+        out_features, in_features, has_bias = _linear_shape(module)
+        self.weight = nn.Parameter(torch.empty(out_features // world_size, in_features), requires_grad=False)
+        self.bias = nn.Parameter(torch.empty(out_features // world_size), requires_grad=False) if has_bias else None
+        self.transposed = isinstance(module, Conv1D)  # checkpoint stores gpt2 Conv1D weights as (in, out)
+        self.rank = rank
+        self.world_size = world_size
+        self.splits = splits
+
+    def read_shard(self, name: str, tensor) -> torch.Tensor:
+        """read this rank's slice of a checkpoint tensor (safetensors slices only read what is indexed)"""
+        out_dim = 1 if self.transposed and name == "weight" else 0
+        ranges = _shard_ranges(tensor.get_shape()[out_dim], self.rank, self.world_size, self.splits)
+        if out_dim == 1:
+            return torch.cat([tensor[:, start:end] for start, end in ranges], dim=1).t()
+        return torch.cat([tensor[start:end] for start, end in ranges], dim=0)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return F.linear(x, self.weight, self.bias)
+
+class RowParallelLinear(nn.Module):
+    """holds a slice of the input features of a linear layer; partial outputs are all-reduced"""
+
+    def __init__(self, module: nn.Module, rank: int, world_size: int):
+        super().__init__()
+        out_features, in_features, has_bias = _linear_shape(module)
+        self.weight = nn.Parameter(torch.empty(out_features, in_features // world_size), requires_grad=False)
+        # bias is added once, after the reduction
+        self.bias = nn.Parameter(torch.empty(out_features), requires_grad=False) if has_bias else None
+        self.transposed = isinstance(module, Conv1D)
+        self.rank = rank
+        self.world_size = world_size
+
+    def read_shard(self, name: str, tensor) -> torch.Tensor:
+        """read this rank's slice of a checkpoint tensor"""
+        if name == "bias":
+            return tensor[:]
+        in_dim = 0 if self.transposed else 1
+        [(start, end)] = _shard_ranges(tensor.get_shape()[in_dim], self.rank, self.world_size)
+        return tensor[start:end].t() if self.transposed else tensor[:, start:end]
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        out = F.linear(x, self.weight)
+        dist.all_reduce(out)
+        if self.bias is not None:
+            out = out + self.bias
+        return out
+
+def shard_model(model: nn.Module, rank: int, world_size: int) -> int:
+    """replace known attention/MLP projections with tensor-parallel slices, returns the number of sharded blocks
+
+    parallel layers are allocated at slice size and left uninitialized, load_sharded_model fills them in
+    """
+    config = model.config
+    num_heads = config.num_attention_heads
+    num_kv_heads = getattr(config, "num_key_value_heads", None) or num_heads
+
+    sharded = 0
+    for parent in list(model.modules()):
+        for column_names, row_name, attention, splits in _SHARD_RULES:
+            columns = [getattr(parent, name, None) for name in column_names]
+            row = getattr(parent, row_name, None)
+            if not all(isinstance(m, (nn.Linear, Conv1D)) for m in columns + [row]):
+                continue
+
+            # uneven splits would need padded collectives, leave those layers replicated
+            if attention and (num_heads % world_size or num_kv_heads % world_size):
+                continue
+            if any(_linear_shape(m)[0] % (splits * world_size) for m in columns):
+                continue
+            if _linear_shape(row)[1] % world_size:
+                continue
+
+            for name, module in zip(column_names, columns):
+                setattr(parent, name, ColumnParallelLinear(module, rank, world_size, splits))
+            setattr(parent, row_name, RowParallelLinear(row, rank, world_size))
+            if attention:
+                # this shard runs attention over num_heads / world_size local heads
+                for attribute in _HEAD_ATTRIBUTES:
+                    value = getattr(parent, attribute, None)
+                    if isinstance(value, int) and not isinstance(value, bool):
+                        setattr(parent, attribute, value // world_size)
+            sharded += 1
+            break
+    return sharded
+
+@contextmanager
+def _empty_weights():
+    """create parameters on the meta device so building a model allocates no weight memory
+
+    buffers stay real since some (e.g. rotary inv_freq) are computed at init and not stored in checkpoints
+    """
+    register_parameter = nn.Module.register_parameter
+
+    def register_meta_parameter(module, name, param):
+        register_parameter(module, name, param)
+        if param is not None:
+            module._parameters[name] = nn.Parameter(param.to("meta"), requires_grad=param.requires_grad)
+
+    nn.Module.register_parameter = register_meta_parameter
+    try:
+        yield
+    finally:
+        nn.Module.register_parameter = register_parameter
+
+def load_sharded_model(model_name: str, weights_dir: str, rank: int, world_size: int):
+    """build the model without weights, shard it, then read only this rank's slices from the safetensors files
+
+    returns (model, number of sharded blocks); peak memory is the shard plus the replicated
+    embeddings, norms and LM head rather than the full model
+    """
+    config = AutoConfig.from_pretrained(model_name)
+    with _empty_weights():
+        model = AutoModelForCausalLM.from_config(config)
+    sharded = shard_model(model, rank, world_size)
+
+    params = dict(model.named_parameters())
+    buffers = dict(model.named_buffers())
+    prefix = model.base_model_prefix
+    for path in sorted(glob.glob(os.path.join(weights_dir, "*.safetensors"))):
+        with safe_open(path, framework="pt") as f:
+            for key in f.keys():
+                # checkpoints may or may not include the base model prefix (e.g. "h.0..." vs "transformer.h.0...")
+                candidates = (key, f"{prefix}.{key}", key.removeprefix(f"{prefix}."))
+                name = next((c for c in candidates if c in params or c in buffers), None)
+                if name is None:
+                    continue
+
+                module_name, _, attribute = name.rpartition(".")
+                module = model.get_submodule(module_name)
+                if isinstance(module, (ColumnParallelLinear, RowParallelLinear)):
+                    tensor = module.read_shard(attribute, f.get_slice(key))
+                else:
+                    tensor = f.get_tensor(key)
+
+                if name in buffers:
+                    if buffers[name].shape == tensor.shape:
+                        buffers[name].copy_(tensor)
+                else:
+                    setattr(module, attribute, nn.Parameter(tensor.to(torch.float32).contiguous(), requires_grad=False))
+
+    # tied LM heads are not stored separately
+    output_embeddings = model.get_output_embeddings()
+    if output_embeddings is not None and output_embeddings.weight.is_meta:
+        output_embeddings.weight = model.get_input_embeddings().weight
+
+    missing = [name for name, param in model.named_parameters() if param.is_meta]
+    if missing:
+        raise RuntimeError(f"Weights missing from the {model_name} checkpoint: {', '.join(missing[:5])}")
+    return model.eval(), sharded
+
+def _decode(model, rank, ctrl, params, tokens, progress, eos_ids):
+    """run one generation request; every shard executes the same steps in lockstep"""
+    top_k = getattr(model.generation_config, "top_k", None)
+    prompt_len = int(ctrl[_PROMPT_LEN])
+    max_new_tokens = int(ctrl[_MAX_NEW_TOKENS])
+    temperature = float(params[0])
+
+    input_ids = tokens[:prompt_len].clone().unsqueeze(0)
+    past_key_values = None
+
+    with torch.no_grad():
+        for step in range(max_new_tokens):
+            outputs = model(input_ids=input_ids, past_key_values=past_key_values, use_cache=True)
+            past_key_values = outputs.past_key_values
+
+            # logits are identical on every shard, rank 0 samples and publishes the token
+            if rank == 0:
+                next_token = sample_next_token(outputs.logits[0, -1], temperature, top_k)
+                tokens[prompt_len + step] = next_token
+                ctrl[_NUM_GENERATED] = step + 1
+                if next_token in eos_ids or step + 1 == max_new_tokens or ctrl[_CANCEL]:
+                    ctrl[_DONE] = 1
+
+            # the other shards read the step result from shared memory after the barrier
+            dist.barrier()
+            if rank == 0:
+                progress.put(step + 1)
+            if ctrl[_DONE]:
+                break
+            input_ids = tokens[prompt_len + step:prompt_len + step + 1].clone().unsqueeze(0)
+
+    # make sure every shard has left the loop before the control block is reused
+    dist.barrier()
+    if rank == 0:
+        progress.put(None)
+
+def _worker_main(rank, world_size, model_name, weights_dir, init_method, threads, eos_ids, ctrl, params, tokens, start_events, progress, ready):
+    """entry point of a shard process"""
+    torch.set_num_threads(threads)
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=world_size)
+
+    model, sharded = load_sharded_model(model_name, weights_dir, rank, world_size)
+    ready.put((rank, sharded))
+
+    start_event = start_events[rank]
+    while True:
+        start_event.wait()
+        start_event.clear()
+        if ctrl[_CMD] == _CMD_SHUTDOWN:
+            break
+        _decode(model, rank, ctrl, params, tokens, progress, eos_ids)
+
+    dist.destroy_process_group()
+
+def _free_port() -> int:
+    """ask the OS for an unused local port for the gloo rendezvous"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class TensorParallelEngine(BaseEngine):
+    """CPU engine that shards the model across local worker processes (torch.distributed, gloo backend)"""
+
+    def __init__(
+        self,
+        model_name: str = "gpt2",
+        world_size: int = 2,
+        threads_per_shard: Optional[int] = None,
+        **kwargs
+    ):
+        super().__init__(model_name, **kwargs)
+        self.world_size = world_size
+        self.threads_per_shard = threads_per_shard or max(1, (os.cpu_count() or 1) // world_size)
+        self.tokenizer = None
+        self.max_positions = None
+        self.eos_token_ids = None
+        self._workers = []
+        self._lock = None
+
+    async def initialize(self):
+        """spawn and load the shard processes in background"""
+        print(f"Loading model: {self.model_name} across {self.world_size} shards")
+
+        loop = asyncio.get_event_loop()
+        self._lock = asyncio.Lock()
+        await loop.run_in_executor(None, self._start_workers)
+        print(f"Model loaded successfully")
+
+    def _start_workers(self):
+        """func to start shard processes in background"""
+        # only the tokenizer and config live in the server process
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        config = AutoConfig.from_pretrained(self.model_name)
+        weights_dir = self._weights_dir()
+        self.max_positions = getattr(config, "max_position_embeddings", None) or getattr(config, "n_positions", 2048)
+        self.eos_token_ids = eos_token_ids(self.tokenizer, self._generation_config(config))
+
+        # per-request state shared with every shard
+        self._ctrl = torch.zeros(8, dtype=torch.int64).share_memory_()
+        self._params = torch.zeros(1, dtype=torch.float32).share_memory_()
+        self._tokens = torch.zeros(self.max_positions, dtype=torch.int64).share_memory_()
+
+        ctx = mp.get_context("spawn")
+        self._start_events = [ctx.Event() for _ in range(self.world_size)]
+        self._progress = ctx.Queue()
+        ready = ctx.Queue()
+        init_method = f"tcp://127.0.0.1:{_free_port()}"
+
+        self._workers = [
+            ctx.Process(
+                target=_worker_main,
+                args=(
+                    rank, self.world_size, self.model_name, weights_dir, init_method, self.threads_per_shard, self.eos_token_ids,
+                    self._ctrl, self._params, self._tokens, self._start_events, self._progress, ready,
+                ),
+                daemon=True,
+            )
+            for rank in range(self.world_size)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        for _ in range(self.world_size):
+            rank, sharded = self._wait_for(ready)
+            print(f"Shard {rank} ready ({sharded} blocks sharded)")
+
+    def _generation_config(self, config) -> GenerationConfig:
+        """generation_config.json when the checkpoint ships one (instruct models list end-of-turn ids there)"""
+        try:
+            return GenerationConfig.from_pretrained(self.model_name)
+        except OSError:
+            return GenerationConfig.from_model_config(config)
+
+    def _weights_dir(self) -> str:
+        """local directory holding the safetensors weights (downloaded once here, not by every shard)"""
+        weights_dir = self.model_name
+        if not os.path.isdir(weights_dir):
+            from huggingface_hub import snapshot_download
+            weights_dir = snapshot_download(self.model_name, allow_patterns=["*.safetensors", "*.json"])
+        if not glob.glob(os.path.join(weights_dir, "*.safetensors")):
+            raise RuntimeError(f"{self.model_name} has no safetensors weights, which per-shard loading requires")
+        return weights_dir
+
+    def _wait_for(self, q):
+        """blocking get that fails fast if a shard process died"""
+        while True:
+            try:
+                return q.get(timeout=1.0)
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self._workers):
+                    raise RuntimeError("Tensor-parallel worker exited unexpectedly")
+
+    def _submit(self, sequence: Sequence):
+        """write a request into shared memory and wake up the shards"""
+        prompt_len = len(sequence.prompt_ids)
+        self._tokens[:prompt_len] = torch.tensor(sequence.prompt_ids, dtype=torch.int64)
+        self._params[0] = sequence.temperature
+        self._ctrl.zero_()
+        self._ctrl[_PROMPT_LEN] = prompt_len
+        self._ctrl[_MAX_NEW_TOKENS] = sequence.max_tokens
+        self._ctrl[_CMD] = _CMD_GENERATE
+        for event in self._start_events:
+            event.set()
+
+    def _drain(self):
+        """wait until the shards have finished the current request"""
+        while self._wait_for(self._progress) is not None:
+            pass
+
+    def _new_sequence(
+        self,
+        messages: List[Message],
+        temperature: float,
+        max_tokens: int,
+        stop: Optional[Union[str, List[str]]],
+    ) -> Sequence:
+        """tokenize the prompt and set up decoding state"""
+        prompt_ids = self.tokenizer(self._messages_to_prompt(messages))["input_ids"]
+        prompt_ids, max_tokens = fit_to_context(prompt_ids, max_tokens, self.max_positions)
+        return Sequence(
+            self.tokenizer,
+            prompt_ids,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stop=stop,
+            eos_token_ids=self.eos_token_ids,
+        )
+
+    async def generate(
+        self,
+        messages: List[Message],
+        temperature: float = 0.7,
+        max_tokens: int = 512,
+        stop: Optional[Union[str, List[str]]] = None,
+        adapter: Optional[str] = None,
+    ) -> Generation:
+        """generate response"""
+        chunks = []
+        async for chunk in self.generate_stream(messages, temperature, max_tokens, stop, adapter):
+            chunks.append(chunk)
+        return Generation(
+            text="".join(chunk.text for chunk in chunks).strip(),
+            finish_reason=chunks[-1].finish_reason,
+            prompt_tokens=chunks[-1].prompt_tokens,
+            completion_tokens=chunks[-1].completion_tokens,
+        )
+
+    async def generate_stream(
+        self,
+        messages: List[Message],
+        temperature: float = 0.7,
+        max_tokens: int = 512,
+        stop: Optional[Union[str, List[str]]] = None,
+        adapter: Optional[str] = None,
+    ) -> AsyncGenerator[Generation, None]:
+        """streaming generate response, one decode step at a time"""
+        if adapter is not None:
+            raise UnsupportedAdapterError("LoRA adapters are not supported by the tensor-parallel engine")
+        sequence = self._new_sequence(messages, temperature, max_tokens, stop)
+        prompt_len = len(sequence.prompt_ids)
+        loop = asyncio.get_event_loop()
+
+        # the shards serve one request at a time
+        async with self._lock:
+            await loop.run_in_executor(None, self._submit, sequence)
+            shards_done = False
+            try:
+                while not sequence.finished:
+                    num_generated = await loop.run_in_executor(None, self._wait_for, self._progress)
+                    if num_generated is None:
+                        shards_done = True
+                        break
+
+                    text = ""
+                    for position in range(len(sequence.output_ids), num_generated):
+                        text += sequence.append(int(self._tokens[prompt_len + position]))
+                        if sequence.finished:
+                            break
+                    if text:
+                        yield Generation(text=text)
+
+                yield Generation(
+                    text="",
+                    finish_reason=sequence.finish_reason,
+                    prompt_tokens=prompt_len,
+                    completion_tokens=len(sequence.output_ids),
+                )
+            finally:
+                if not shards_done:
+                    # stop string hit or client went away: halt the shards at the next step
+                    self._ctrl[_CANCEL] = 1
+                    await loop.run_in_executor(None, self._drain)
+
+    async def shutdown(self):
+        """stop shard processes"""
+        if self._workers:
+            self._ctrl[_CMD] = _CMD_SHUTDOWN
+            for event in self._start_events:
+                event.set()
+            for worker in self._workers:
+                worker.join(timeout=10)
+                if worker.is_alive():
+                    worker.terminate()
+            self._workers = []
+        print("Engine shutdown complete")
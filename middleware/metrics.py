@@ -34,6 +34,47 @@ generation_latency = Histogram(
     buckets=[0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0]
 )
 
+batch_size = Histogram(
+    'llm_batch_size',
+    'Number of requests merged into a single forward pass',
+    ['batch_type'],  # 'embedding' or 'generation'
+    buckets=[1, 2, 4, 8, 16, 32, 64, 128]
+)
+
+adapter_load_latency = Histogram(
+    'llm_lora_adapter_load_seconds',
+    'Time to load a LoRA adapter into the adapter cache',
+    buckets=[0.01, 0.05, 0.1, 0.5, 1.0, 5.0]
+)
+
+adapter_cache_requests = Counter(
+    'llm_lora_adapter_cache_requests_total',
+    'LoRA adapter cache lookups',
+    ['result']  # 'hit' or 'miss'
+)
+
+adapters_resident = Gauge(
+    'llm_lora_adapters_resident',
+    'Number of LoRA adapters held in the adapter cache (evicted adapters still used by running requests are not counted)'
+)
+
+adapter_resident_bytes = Gauge(
+    'llm_lora_adapter_resident_bytes',
+    'Memory held by LoRA adapter weights in the adapter cache (excludes evicted adapters still used by running requests)'
+)
+
+router_requests = Counter(
+    'llm_router_requests_total',
+    'Requests proxied by the router',
+    ['replica', 'result']  # 'affinity', 'spillover' or 'error'
+)
+
+router_replica_healthy = Gauge(
+    'llm_router_replica_healthy',
+    'Whether the replica passed its last health check',
+    ['replica']
+)
+
 engine_errors = Counter(
     'llm_engine_errors_total',
     'Total number of engine errors',
@@ -82,4 +123,25 @@ def record_generation_metrics(tokens: int, ttft: float, total_time: float):
     """record generation metrics"""
     generation_tokens.observe(tokens)
     generation_latency.labels(metric_type="ttft").observe(ttft)
-    generation_latency.labels(metric_type="total").observe(total_time)
\ No newline at end of file
+    generation_latency.labels(metric_type="total").observe(total_time)
+
+def record_batch_metrics(batch_type: str, size: int):
+    """record the size of a dispatched batch"""
+    batch_size.labels(batch_type=batch_type).observe(size)
+
+def record_adapter_load(duration: float):
+    """record how long an adapter load took"""
+    adapter_load_latency.observe(duration)
+
+def record_adapter_cache(result: str):
+    """record an adapter cache hit or miss"""
+    adapter_cache_requests.labels(result=result).inc()
+
+def set_adapter_residency(count: int, nbytes: int):
+    """record the adapters currently in the adapter cache"""
+    adapters_resident.set(count)
+    adapter_resident_bytes.set(nbytes)
+
+def record_routing_metrics(replica: str, result: str):
+    """record a routing decision"""
+    router_requests.labels(replica=replica, result=result).inc()
\ No newline at end of file
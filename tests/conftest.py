@@ -0,0 +1,20 @@
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+VOCAB_SIZE = 64
+
+def tiny_gpt2_config(**overrides) -> GPT2Config:
+    """a two-layer GPT2 small enough to build and run in milliseconds"""
+    options = dict(
+        n_layer=2, n_embd=32, n_head=4, n_positions=1024, vocab_size=VOCAB_SIZE,
+        bos_token_id=0, eos_token_id=1, pad_token_id=0,
+    )
+    options.update(overrides)
+    return GPT2Config(**options)
+
+@pytest.fixture
+def tiny_gpt2():
+    """randomly initialised GPT2, no download needed"""
+    torch.manual_seed(0)
+    return GPT2LMHeadModel(tiny_gpt2_config()).eval()
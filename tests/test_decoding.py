@@ -0,0 +1,137 @@
+from types import SimpleNamespace
+
+from engine.decoding import IncrementalDetokenizer, Sequence, StopMatcher, eos_token_ids, fit_to_context
+
+class StubTokenizer:
+    """byte-level tokenizer: token id i is the byte i, ids from 256 up are special (eos is 256)"""
+    eos_token_id = 256
+
+    def encode(self, text):
+        return list(text.encode("utf-8"))
+
+    def decode(self, ids, skip_special_tokens=True):
+        data = bytes(i for i in ids if i < 256)
+        return data.decode("utf-8", errors="replace")
+
+def _run(sequence, token_ids):
+    """feed tokens until the sequence finishes, returning the emitted deltas"""
+    deltas = []
+    for token_id in token_ids:
+        deltas.append(sequence.append(token_id))
+        if sequence.finished:
+            break
+    return deltas
+
+def test_stop_matcher_holds_back_partial_match():
+    matcher = StopMatcher(["###"])
+    assert matcher.feed("hello #") == ("hello ", False)
+    assert matcher.feed("#") == ("", False)
+    assert matcher.feed(" no") == ("## no", False)
+
+def test_stop_matcher_stops_at_earliest_of_multiple_strings():
+    matcher = StopMatcher(["END", "\n\n"])
+    assert matcher.feed("a\n") == ("a", False)
+    assert matcher.feed("\nEND") == ("", True)
+
+    matcher = StopMatcher(["world", "lo"])
+    assert matcher.feed("hello world") == ("hel", True)
+
+def test_stop_matcher_flush_releases_pending():
+    matcher = StopMatcher(["</s>"])
+    assert matcher.feed("done</") == ("done", False)
+    assert matcher.flush() == "</"
+    assert matcher.flush() == ""
+
+def test_stop_matcher_without_stop_strings_passes_through():
+    assert StopMatcher().feed("anything") == ("anything", False)
+    assert StopMatcher([""]).feed("x") == ("x", False)
+
+def test_detokenizer_holds_back_incomplete_characters():
+    tokenizer = StubTokenizer()
+    detokenizer = IncrementalDetokenizer(tokenizer, tokenizer.encode("say"))
+    first, second = "é".encode("utf-8")
+
+    assert detokenizer.add(ord(" ")) == " "
+    assert detokenizer.add(first) == ""
+    assert detokenizer.add(second) == "é"
+
+def test_detokenizer_flush_releases_incomplete_tail():
+    tokenizer = StubTokenizer()
+    detokenizer = IncrementalDetokenizer(tokenizer, tokenizer.encode("say"))
+    assert detokenizer.add("é".encode("utf-8")[0]) == ""
+    assert detokenizer.flush() == "�"
+    assert detokenizer.flush() == ""
+
+def test_sequence_strips_leading_whitespace():
+    tokenizer = StubTokenizer()
+    sequence = Sequence(tokenizer, tokenizer.encode("Q:"), max_tokens=20)
+    deltas = _run(sequence, tokenizer.encode("  hi there") + [tokenizer.eos_token_id])
+
+    assert sequence.text == "hi there"
+    assert "".join(deltas) == "hi there"
+    assert sequence.finish_reason == "stop"
+
+def test_sequence_stop_string_spanning_tokens():
+    tokenizer = StubTokenizer()
+    streamed = []
+    sequence = Sequence(tokenizer, tokenizer.encode("Q:"), max_tokens=50, stop=["\nUser:"], on_delta=streamed.append)
+    _run(sequence, tokenizer.encode("Answer.\nUser: more"))
+
+    assert sequence.text == "Answer."
+    assert "".join(streamed) == "Answer."
+    assert sequence.finish_reason == "stop"
+    # generation ends as soon as the stop string completes
+    assert len(sequence.output_ids) == len("Answer.\nUser:")
+
+def test_sequence_accepts_single_stop_string():
+    tokenizer = StubTokenizer()
+    sequence = Sequence(tokenizer, tokenizer.encode("Q:"), max_tokens=50, stop="!")
+    _run(sequence, tokenizer.encode("wow! ignored"))
+    assert sequence.text == "wow"
+
+def test_sequence_flushes_held_back_text_at_eos():
+    tokenizer = StubTokenizer()
+    sequence = Sequence(tokenizer, tokenizer.encode("Q:"), max_tokens=50, stop=["STOP"])
+    _run(sequence, tokenizer.encode("ok ST") + [tokenizer.eos_token_id])
+
+    assert sequence.text == "ok ST"
+    assert sequence.finish_reason == "stop"
+
+def test_sequence_flushes_held_back_text_at_length():
+    tokenizer = StubTokenizer()
+    sequence = Sequence(tokenizer, tokenizer.encode("Q:"), max_tokens=6, stop=["STOP"])
+    _run(sequence, tokenizer.encode("a éSTOP"))
+
+    # text held back as a possible stop string is released
+    assert sequence.finish_reason == "length"
+    assert sequence.text == "a éST"
+
+    sequence = Sequence(tokenizer, tokenizer.encode("Q:"), max_tokens=3, stop=["STOP"])
+    _run(sequence, tokenizer.encode("a ") + ["é".encode("utf-8")[0]])
+    # so is an incomplete character
+    assert sequence.finish_reason == "length"
+    assert sequence.text == "a �"
+
+def test_sequence_stops_at_any_eos_id():
+    tokenizer = StubTokenizer()
+    end_of_turn = 257
+    eos_ids = eos_token_ids(tokenizer, SimpleNamespace(eos_token_id=[end_of_turn, tokenizer.eos_token_id]))
+    assert eos_ids == {tokenizer.eos_token_id, end_of_turn}
+
+    sequence = Sequence(tokenizer, tokenizer.encode("Q:"), max_tokens=50, eos_token_ids=eos_ids)
+    _run(sequence, tokenizer.encode("done") + [end_of_turn] + tokenizer.encode(" more"))
+
+    assert sequence.text == "done"
+    assert sequence.finish_reason == "stop"
+    assert len(sequence.output_ids) == len("done") + 1
+
+def test_eos_token_ids_accepts_int_or_missing_config():
+    tokenizer = StubTokenizer()
+    assert eos_token_ids(tokenizer, SimpleNamespace(eos_token_id=300)) == {256, 300}
+    assert eos_token_ids(tokenizer, SimpleNamespace(eos_token_id=None)) == {256}
+    assert eos_token_ids(tokenizer) == {256}
+
+def test_fit_to_context_left_truncates_and_caps_max_tokens():
+    assert fit_to_context([1, 2, 3], 100, None) == ([1, 2, 3], 100)
+    assert fit_to_context([1, 2, 3], 100, 10) == ([1, 2, 3], 7)
+    assert fit_to_context(list(range(20)), 5, 10) == (list(range(11, 20)), 1)
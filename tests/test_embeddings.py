@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+import torch
+from prometheus_client import REGISTRY
+from tokenizers import Tokenizer, models, pre_tokenizers
+from transformers import PreTrainedTokenizerFast
+
+from engine.batcher import MicroBatcher
+from engine.simple_engine import SimpleEngine
+
+MAX_LENGTH = 8
+
+@pytest.fixture
+def engine(tiny_gpt2):
+    """SimpleEngine embedding with the tiny GPT2 and a word-level tokenizer, no download needed"""
+    vocab = {"[PAD]": 0, "[UNK]": 1, **{f"w{i}": i + 2 for i in range(60)}}
+    word_level = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+    word_level.pre_tokenizer = pre_tokenizers.Whitespace()
+
+    engine = SimpleEngine(model_name="tiny", embedding_max_wait_ms=50)
+    engine.embedding_tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=word_level, unk_token="[UNK]", pad_token="[PAD]", model_max_length=MAX_LENGTH
+    )
+    engine.embedding_model = tiny_gpt2
+    return engine
+
+def _embedding_batches():
+    """(number of observations, summed sizes) of the embedding batch size histogram"""
+    labels = {"batch_type": "embedding"}
+    return (
+        REGISTRY.get_sample_value("llm_batch_size_count", labels) or 0,
+        REGISTRY.get_sample_value("llm_batch_size_sum", labels) or 0,
+    )
+
+def _words(*ids):
+    return " ".join(f"w{i}" for i in ids)
+
+def test_concurrent_embed_calls_share_one_batch(engine):
+    async def run():
+        results = await asyncio.gather(
+            engine.embed([_words(1, 2), _words(3)]),
+            engine.embed([_words(4, 5, 6)]),
+            engine.embed([_words(7), _words(8, 9), _words(10)]),
+        )
+        await engine.embedding_batcher.shutdown()
+        return results
+
+    count, total = _embedding_batches()
+    results = asyncio.run(run())
+
+    assert [len(result) for result in results] == [2, 1, 3]
+    assert _embedding_batches() == (count + 1, total + 6)
+
+def test_embedding_does_not_depend_on_co_batched_texts(engine):
+    text = _words(3, 4, 5)
+    # co-batched with texts in both a shorter and a longer length bucket
+    others = [_words(1), _words(*range(10, 17)), _words(20, 21)]
+
+    async def run():
+        alone = await engine.embed([text])
+        together = await engine.embed(others[:2] + [text] + others[2:])
+        await engine.embedding_batcher.shutdown()
+        return alone[0], together[2]
+
+    alone, together = asyncio.run(run())
+    torch.testing.assert_close(torch.tensor(together.embedding), torch.tensor(alone.embedding), atol=1e-5, rtol=1e-5)
+    assert torch.tensor(alone.embedding).norm().item() == pytest.approx(1.0, abs=1e-5)
+
+def test_prompt_tokens_count_truncated_input(engine):
+    async def run():
+        results = await engine.embed([_words(*range(20)), _words(1, 2, 3), ""])
+        await engine.embedding_batcher.shutdown()
+        return results
+
+    long, short, empty = asyncio.run(run())
+    assert long.prompt_tokens == MAX_LENGTH
+    assert short.prompt_tokens == 3
+    assert empty.prompt_tokens == 0
+    assert len(empty.embedding) == len(short.embedding)
+
+def test_cancelled_submit_is_dropped_before_the_batch_runs():
+    batches = []
+
+    def batch_fn(items):
+        batches.append(items)
+        return [item.upper() for item in items]
+
+    async def run():
+        batcher = MicroBatcher(batch_fn, max_wait_ms=50)
+        abandoned = asyncio.ensure_future(batcher.submit("gone"))
+        await asyncio.sleep(0.01)
+        abandoned.cancel()
+        result = await batcher.submit("kept")
+        await batcher.shutdown()
+        return result
+
+    assert asyncio.run(run()) == "KEPT"
+    assert batches == [["kept"]]
@@ -0,0 +1,112 @@
+import copy
+import json
+import os
+
+import pytest
+import torch
+from safetensors.torch import save_file
+
+from engine.lora import (
+    LoRAAdapter,
+    LoRAManager,
+    UnsupportedAdapterError,
+    _check_supported,
+    _pattern_value,
+    load_adapter,
+)
+
+MODULES = {"transformer.h.0.attn.c_attn": (32, 96), "transformer.h.1.mlp.c_fc": (32, 128)}
+
+def _write_adapter(path, rank=4, seed=0, **config):
+    """save a PEFT-style adapter for the tiny GPT2 (Conv1D modules, in x out weights)"""
+    generator = torch.Generator().manual_seed(seed)
+    tensors = {}
+    for module, (in_features, out_features) in MODULES.items():
+        tensors[f"base_model.model.{module}.lora_A.weight"] = torch.randn(rank, in_features, generator=generator)
+        tensors[f"base_model.model.{module}.lora_B.weight"] = torch.randn(out_features, rank, generator=generator)
+    os.makedirs(path)
+    save_file(tensors, os.path.join(path, "adapter_model.safetensors"))
+    with open(os.path.join(path, "adapter_config.json"), "w") as f:
+        json.dump({"peft_type": "LORA", "r": rank, "lora_alpha": 8, **config}, f)
+
+def _merged(model, adapter):
+    """copy of the base model with the adapter folded into its weights"""
+    merged = copy.deepcopy(model)
+    with torch.no_grad():
+        for module, (lora_a, lora_b, scaling) in adapter.weights.items():
+            merged.get_submodule(module).weight += (lora_a.t() @ lora_b.t()) * scaling
+    return merged
+
+def test_pattern_value_matches_module_name_suffix():
+    patterns = {"c_attn": 16, "h.1.mlp.c_fc": 2}
+    assert _pattern_value(patterns, "transformer.h.0.attn.c_attn", 8) == 16
+    assert _pattern_value(patterns, "transformer.h.1.mlp.c_fc", 8) == 2
+    assert _pattern_value(patterns, "transformer.h.11.mlp.c_fc", 8) == 8
+    assert _pattern_value(patterns, "transformer.h.0.attn.c_proj", 8) == 8
+
+@pytest.mark.parametrize("config, state_dict", [
+    ({"peft_type": "IA3"}, {}),
+    ({"use_dora": True}, {}),
+    ({"bias": "lora_only"}, {}),
+    ({"modules_to_save": ["lm_head"]}, {}),
+    ({}, {"base_model.model.transformer.wte.lora_embedding_A": torch.zeros(1)}),
+])
+def test_check_supported_rejects_features_it_cannot_apply(config, state_dict):
+    with pytest.raises(UnsupportedAdapterError):
+        _check_supported("adapter", config, state_dict)
+
+def test_load_adapter_applies_rank_and_alpha_patterns(tmp_path):
+    path = str(tmp_path / "patterned")
+    _write_adapter(path, rank_pattern={"c_fc": 2}, alpha_pattern={"c_attn": 32})
+    adapter = load_adapter("patterned", path)
+
+    assert adapter.weights["transformer.h.0.attn.c_attn"][2] == 32 / 4
+    assert adapter.weights["transformer.h.1.mlp.c_fc"][2] == 8 / 2
+
+def test_mixed_adapter_rows_match_merged_weights(tiny_gpt2, tmp_path):
+    _write_adapter(str(tmp_path / "one"), seed=1)
+    _write_adapter(str(tmp_path / "two"), seed=2, use_rslora=True)
+    base = copy.deepcopy(tiny_gpt2)
+    manager = LoRAManager(tiny_gpt2, str(tmp_path))
+    one, two = manager.get("one"), manager.get("two")
+
+    input_ids = torch.tensor([[5, 6, 7, 8]] * 4)
+    manager.set_batch([one, None, two, one])
+    with torch.no_grad():
+        logits = tiny_gpt2(input_ids).logits
+    manager.clear_batch()
+
+    with torch.no_grad():
+        expected = [
+            _merged(base, one)(input_ids[:1]).logits[0],
+            base(input_ids[:1]).logits[0],
+            _merged(base, two)(input_ids[:1]).logits[0],
+            _merged(base, one)(input_ids[:1]).logits[0],
+        ]
+    for row, reference in enumerate(expected):
+        torch.testing.assert_close(logits[row], reference, atol=1e-5, rtol=1e-5)
+
+def test_set_batch_groups_rows_by_adapter_object():
+    weights = {"transformer.h.0.attn.c_attn": (torch.zeros(1, 32), torch.zeros(96, 1), 1.0)}
+    evicted, reloaded = LoRAAdapter("same", weights), LoRAAdapter("same", dict(weights))
+    manager = LoRAManager(None)
+
+    manager.set_batch([evicted, reloaded, evicted])
+
+    groups = manager.active_adapters()
+    assert [adapter for adapter, _ in groups] == [evicted, reloaded]
+    assert [rows.tolist() for _, rows in groups] == [[0, 2], [1]]
+
+def test_least_recently_used_adapter_is_evicted(tiny_gpt2, tmp_path):
+    for seed, name in enumerate(["a", "b", "c"]):
+        _write_adapter(str(tmp_path / name), seed=seed)
+    manager = LoRAManager(tiny_gpt2, str(tmp_path), max_adapters=2)
+
+    a = manager.get("a")
+    manager.get("b")
+    assert manager.get("a") is a
+    manager.get("c")
+
+    assert manager.get_resident("b") is None
+    assert manager.get_resident("a") is a
+    assert manager.get_resident("c") is not None
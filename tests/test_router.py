@@ -0,0 +1,191 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+
+from app.router import ConsistentHashRing, _prefix_key
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN_DELAY_MS = 50
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _start(app: str, port: int, **env) -> subprocess.Popen:
+    """run a uvicorn app from the repo root with extra settings as environment variables"""
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port)],
+        cwd=REPO_ROOT,
+        env={**os.environ, **{name.upper(): str(value) for name, value in env.items()}},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+def _wait_healthy(url: str, timeout: float = 60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{url}/health", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"{url} did not become healthy")
+
+def _chat(system: str, user: str, **extra) -> dict:
+    return {
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": user},
+        ],
+        "max_tokens": 2,
+        **extra,
+    }
+
+@pytest.fixture(scope="module")
+def cluster():
+    """two fake-engine replicas behind the router"""
+    replica_ports = [_free_port(), _free_port()]
+    replicas = {
+        f"http://127.0.0.1:{port}": _start(
+            "app.main:app", port, engine_type="fake", fake_token_delay_ms=TOKEN_DELAY_MS
+        )
+        for port in replica_ports
+    }
+    router_url = f"http://127.0.0.1:{_free_port()}"
+    processes = list(replicas.values())
+
+    try:
+        for url in replicas:
+            _wait_healthy(url)
+        processes.append(_start(
+            "app.router:app",
+            int(router_url.rsplit(":", 1)[1]),
+            router_replicas=",".join(replicas),
+            router_health_interval=0.5,
+        ))
+        _wait_healthy(router_url)
+        yield router_url, replicas
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+def test_ring_select_is_stable_and_skips_unhealthy():
+    replicas = ["http://a", "http://b", "http://c"]
+    ring = ConsistentHashRing(replicas, virtual_nodes=50)
+    healthy = set(replicas)
+
+    owners = {f"prompt {i}": ring.select(f"prompt {i}", {}, healthy) for i in range(30)}
+    assert all(not spilled for _, spilled in owners.values())
+    assert {replica for replica, _ in owners.values()} == set(replicas)
+    assert all(ring.select(key, {}, healthy) == owner for key, owner in owners.items())
+
+    # keys owned by a failed replica move, every other key stays put
+    for key, (owner, _) in owners.items():
+        replica, _ = ring.select(key, {}, healthy - {"http://a"})
+        assert replica != "http://a"
+        if owner != "http://a":
+            assert replica == owner
+
+    assert ring.select("prompt 0", {}, set()) == (None, False)
+
+def test_ring_select_spills_over_at_capacity():
+    ring = ConsistentHashRing(["http://a", "http://b"], virtual_nodes=50, load_factor=1.25)
+    healthy = {"http://a", "http://b"}
+    preferred, _ = ring.select("system prompt", {}, healthy)
+    other = ({"http://a", "http://b"} - {preferred}).pop()
+
+    # capacity = ceil(1.25 * (total + 1) / 2)
+    assert ring.select("system prompt", {preferred: 1, other: 0}, healthy) == (preferred, False)
+    assert ring.select("system prompt", {preferred: 2, other: 0}, healthy) == (other, True)
+    # the only healthy replica takes the request even above capacity
+    assert ring.select("system prompt", {preferred: 5}, {preferred}) == (preferred, False)
+
+def test_prefix_key():
+    assert _prefix_key(["You are  a pirate.\nBe brief."], 3) == "You are a"
+    assert _prefix_key(["one two", "three four"], 3) == "one two three"
+    assert _prefix_key(["one two"], 32) == "one two"
+    assert _prefix_key([], 32) == ""
+
+def test_prefix_affinity(cluster):
+    router_url, replicas = cluster
+    served_by = set()
+    for i in range(16):
+        system = f"You are assistant number {i}."
+        first = httpx.post(f"{router_url}/v1/chat/completions", json=_chat(system, "hello"), timeout=30)
+        second = httpx.post(f"{router_url}/v1/chat/completions", json=_chat(system, "another question"), timeout=30)
+        assert first.status_code == second.status_code == 200
+        # same conversation prefix, same replica
+        assert first.headers["x-served-by"] == second.headers["x-served-by"]
+        served_by.add(first.headers["x-served-by"])
+
+    assert served_by == set(replicas)
+
+def test_bounded_load_spillover(cluster):
+    router_url, replicas = cluster
+    # long streams keep requests in flight so the preferred replica fills up
+    payload = _chat("Shared system prompt.", "count", max_tokens=20, stream=True)
+
+    def request(_):
+        with httpx.stream("POST", f"{router_url}/v1/chat/completions", json=payload, timeout=30) as response:
+            response.read()
+            return response.status_code, response.headers["x-served-by"]
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        results = list(pool.map(request, range(6)))
+
+    assert all(status == 200 for status, _ in results)
+    assert {replica for _, replica in results} == set(replicas)
+
+def test_streaming_is_not_buffered(cluster):
+    router_url, _ = cluster
+    max_tokens = 20
+    payload = _chat("Streaming check.", "one two three", max_tokens=max_tokens, stream=True)
+
+    start_time = time.time()
+    chunk_times = []
+    with httpx.stream("POST", f"{router_url}/v1/chat/completions", json=payload, timeout=30) as response:
+        assert response.status_code == 200
+        for line in response.iter_lines():
+            if line.startswith("data: ") and line != "data: [DONE]":
+                chunk_times.append(time.time() - start_time)
+
+    total = max_tokens * TOKEN_DELAY_MS / 1000
+    assert len(chunk_times) > max_tokens // 2
+    # chunks arrive while the replica is still generating, not all at once at the end
+    assert chunk_times[0] < total / 2
+    assert chunk_times[-1] - chunk_times[0] > total / 2
+
+def test_failover(cluster):
+    router_url, replicas = cluster
+    systems = [f"Failover prompt {i}." for i in range(16)]
+    owners = {
+        system: httpx.post(f"{router_url}/v1/chat/completions", json=_chat(system, "hi"), timeout=30).headers["x-served-by"]
+        for system in systems
+    }
+    failed = next(iter(replicas))
+    survivor = next(url for url in replicas if url != failed)
+    assert failed in owners.values()
+
+    replicas[failed].terminate()
+    replicas[failed].wait(timeout=10)
+
+    # requests owned by the dead replica are re-routed, before and after the health check notices
+    for _ in range(2):
+        for system in systems:
+            response = httpx.post(f"{router_url}/v1/chat/completions", json=_chat(system, "hi"), timeout=30)
+            assert response.status_code == 200
+            assert response.headers["x-served-by"] == survivor
+        time.sleep(1.0)
+
+    health = httpx.get(f"{router_url}/health", timeout=5).json()
+    assert health["replicas"][failed]["healthy"] is False
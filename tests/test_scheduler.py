@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import torch
+
+from engine.decoding import Sequence
+from engine.scheduler import ContinuousBatcher, _Batch, _left_pad
+
+class IdTokenizer:
+    """decodes ids as space separated numbers; eos never comes up so rows run to max_tokens"""
+    eos_token_id = -1
+
+    def decode(self, ids, skip_special_tokens=True):
+        return "".join(f" {i}" for i in ids)
+
+def _greedy(model, prompt_ids, max_tokens):
+    """reference decode: full forward pass per token, no cache, no batching"""
+    ids = list(prompt_ids)
+    with torch.no_grad():
+        for _ in range(max_tokens):
+            ids.append(int(model(torch.tensor([ids])).logits[0, -1].argmax()))
+    return ids[len(prompt_ids):]
+
+def _sequence(prompt_ids, max_tokens):
+    return Sequence(IdTokenizer(), prompt_ids, temperature=0, max_tokens=max_tokens)
+
+def test_left_pad():
+    tensor = torch.ones(2, 3)
+    assert torch.equal(_left_pad(tensor, 5, 1), torch.tensor([[0, 0, 1, 1, 1.0]] * 2))
+    assert _left_pad(tensor, 5, -2).shape == (5, 3)
+    assert _left_pad(tensor, 2, 1) is tensor
+
+def test_batch_keep_drops_rows_and_trims_shared_padding():
+    key = torch.arange(3 * 4, dtype=torch.float32).view(3, 1, 4, 1)
+    attention_mask = torch.tensor([[1, 1, 1, 1], [0, 0, 1, 1], [0, 1, 1, 1]])
+    batch = _Batch(["a", "b", "c"], ((key, key.clone()),), attention_mask, [10, 11, 12])
+
+    batch.keep([1, 2])
+
+    assert batch.entries == ["b", "c"]
+    assert batch.next_tokens == [11, 12]
+    # the first column was only needed by row "a"
+    assert torch.equal(batch.attention_mask, torch.tensor([[0, 1, 1], [1, 1, 1]]))
+    assert torch.equal(batch.past_key_values[0][0], key[1:, :, 1:])
+
+def test_batch_merge_left_pads_the_shorter_cache():
+    short = _Batch(["a"], ((torch.ones(1, 1, 2, 1), torch.ones(1, 1, 2, 1)),), torch.ones(1, 2, dtype=torch.long), [5])
+    long = _Batch(["b"], ((torch.ones(1, 1, 4, 1), torch.ones(1, 1, 4, 1)),), torch.ones(1, 4, dtype=torch.long), [6])
+
+    short.merge(long)
+
+    assert short.entries == ["a", "b"]
+    assert short.next_tokens == [5, 6]
+    assert torch.equal(short.attention_mask, torch.tensor([[0, 0, 1, 1], [1, 1, 1, 1]]))
+    assert torch.equal(short.past_key_values[0][0][:, 0, :, 0], torch.tensor([[0, 0, 1, 1.0], [1, 1, 1, 1]]))
+
+def test_staggered_arrivals_match_greedy_decoding(tiny_gpt2):
+    requests = [([3, 4, 5], 12), ([7], 4), ([9, 10, 11, 12, 13, 14], 9), ([20, 21], 15), ([30, 31, 32, 33], 6)]
+
+    async def run():
+        batcher = ContinuousBatcher(tiny_gpt2, pad_token_id=0, max_batch_size=3)
+        tasks = []
+        for prompt_ids, max_tokens in requests:
+            tasks.append(asyncio.ensure_future(batcher.submit(_sequence(prompt_ids, max_tokens))))
+            # later requests join a batch that is already decoding
+            await asyncio.sleep(0.01)
+        sequences = await asyncio.gather(*tasks)
+        await batcher.shutdown()
+        return sequences
+
+    for sequence, (prompt_ids, max_tokens) in zip(asyncio.run(run()), requests):
+        assert sequence.finish_reason == "length"
+        assert sequence.output_ids == _greedy(tiny_gpt2, prompt_ids, max_tokens)
+
+def test_cancelled_sequence_never_enters_the_batch(tiny_gpt2):
+    async def run():
+        batcher = ContinuousBatcher(tiny_gpt2, pad_token_id=0)
+        sequence = _sequence([3, 4], 10)
+        sequence.cancelled = True
+        result = await batcher.submit(sequence)
+        await batcher.shutdown()
+        return result
+
+    assert asyncio.run(run()).output_ids == []
+
+def test_shutdown_does_not_wait_for_a_full_batch(tiny_gpt2):
+    async def run():
+        batcher = ContinuousBatcher(tiny_gpt2, pad_token_id=0, max_batch_size=1)
+        task = asyncio.ensure_future(batcher.submit(_sequence([3, 4], 1000)))
+        await asyncio.sleep(0.05)
+
+        start_time = time.time()
+        await batcher.shutdown()
+        elapsed = time.time() - start_time
+        try:
+            await task
+        except RuntimeError as e:
+            return elapsed, str(e)
+        return elapsed, None
+
+    elapsed, error = asyncio.run(run())
+    assert error == "Engine is shutting down"
+    assert elapsed < 1.0
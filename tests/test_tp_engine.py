@@ -0,0 +1,110 @@
+import queue
+import socket
+import time
+
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from transformers import AutoModelForCausalLM, GPT2Config, GPT2LMHeadModel, LlamaConfig, LlamaForCausalLM
+
+from engine.tp_engine import load_sharded_model
+
+WORLD_SIZE = 2
+PROMPT = [[5, 9, 2, 33, 17, 8]]
+NEXT_TOKEN = [[21]]
+
+def _tiny_llama(num_heads: int, num_kv_heads: int) -> LlamaForCausalLM:
+    config = LlamaConfig(
+        hidden_size=8 * num_heads, intermediate_size=64, num_hidden_layers=2,
+        num_attention_heads=num_heads, num_key_value_heads=num_kv_heads,
+        vocab_size=64, max_position_embeddings=128,
+    )
+    return LlamaForCausalLM(config)
+
+MODELS = {
+    # fused q/k/v Conv1D weights stored as (in, out)
+    "gpt2": (lambda: GPT2LMHeadModel(GPT2Config(n_layer=2, n_embd=32, n_head=4, vocab_size=64)), 4),
+    # grouped-query attention with KV heads that split evenly
+    "llama-gqa": (lambda: _tiny_llama(num_heads=4, num_kv_heads=2), 4),
+    # 3 KV heads do not split across 2 ranks, attention stays replicated and only the MLPs are sharded
+    "llama-uneven-gqa": (lambda: _tiny_llama(num_heads=6, num_kv_heads=3), 2),
+}
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _logits(model):
+    """prefill logits, then the logits of one cached decode step"""
+    with torch.no_grad():
+        prefill = model(torch.tensor(PROMPT), use_cache=True)
+        step = model(torch.tensor(NEXT_TOKEN), past_key_values=prefill.past_key_values, use_cache=True)
+    return prefill.logits, step.logits
+
+def _get(results, workers, timeout: float = 120.0):
+    """next shard result, failing as soon as a shard process dies"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            return results.get(timeout=1.0)
+        except queue.Empty:
+            if not all(worker.is_alive() for worker in workers):
+                raise RuntimeError("Shard process exited before returning its logits")
+    raise TimeoutError("Shard processes did not return their logits")
+
+def _shard_worker(rank, model_dirs, init_method, results):
+    """load and run every model's shard on this rank, one process group for all of them"""
+    torch.set_num_threads(1)
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=WORLD_SIZE)
+    try:
+        for name, model_dir in model_dirs.items():
+            model, sharded = load_sharded_model(model_dir, model_dir, rank, WORLD_SIZE)
+            results.put((name, sharded, *_logits(model)))
+    finally:
+        dist.destroy_process_group()
+
+@pytest.fixture(scope="module")
+def checkpoints(tmp_path_factory):
+    """name -> (saved model dir, full model logits, per-rank shard outputs)"""
+    model_dirs, expected = {}, {}
+    for name, (build, _) in MODELS.items():
+        model_dir = tmp_path_factory.mktemp(name)
+        torch.manual_seed(0)
+        build().save_pretrained(model_dir)
+        model_dirs[name] = str(model_dir)
+        expected[name] = _logits(AutoModelForCausalLM.from_pretrained(model_dir).eval())
+
+    # spawning is the slow part, so every model goes through the same pair of shard processes
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    init_method = f"tcp://127.0.0.1:{_free_port()}"
+    workers = [
+        ctx.Process(target=_shard_worker, args=(rank, model_dirs, init_method, results))
+        for rank in range(WORLD_SIZE)
+    ]
+    for worker in workers:
+        worker.start()
+    outputs = {name: [] for name in MODELS}
+    try:
+        for _ in range(WORLD_SIZE * len(MODELS)):
+            name, *output = _get(results, workers)
+            outputs[name].append(output)
+    finally:
+        # a failed rank leaves the other one blocked in a collective
+        for worker in workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+    return {name: (expected[name], outputs[name]) for name in MODELS}
+
+@pytest.mark.parametrize("name", MODELS)
+def test_sharded_model_matches_full_model(name, checkpoints):
+    (expected_prefill, expected_step), outputs = checkpoints[name]
+    assert len(outputs) == WORLD_SIZE
+
+    for sharded, prefill, step in outputs:
+        assert sharded == MODELS[name][1]
+        torch.testing.assert_close(prefill, expected_prefill, atol=1e-5, rtol=1e-5)
+        torch.testing.assert_close(step, expected_step, atol=1e-5, rtol=1e-5)
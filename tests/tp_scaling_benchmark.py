@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import time
+
+from app.models import Message
+from engine.tp_engine import TensorParallelEngine
+
+PROMPTS = [
+    "Explain machine learning briefly",
+    "Tell me about Docker",
+    "What is a distributed system?",
+]
+
+async def benchmark(model_name: str, world_size: int, max_tokens: int, rounds: int):
+    """measure greedy decode throughput for one shard count"""
+    engine = TensorParallelEngine(model_name=model_name, world_size=world_size)
+    await engine.initialize()
+
+    try:
+        # warm up (first step pays for lazy allocations)
+        await engine.generate([Message(role="user", content=PROMPTS[0])], temperature=0.0, max_tokens=8)
+
+        total_tokens = 0
+        start_time = time.time()
+        for _ in range(rounds):
+            for prompt in PROMPTS:
+                result = await engine.generate(
+                    [Message(role="user", content=prompt)],
+                    temperature=0.0,
+                    max_tokens=max_tokens
+                )
+                total_tokens += result.completion_tokens
+        duration = time.time() - start_time
+    finally:
+        await engine.shutdown()
+
+    return total_tokens, duration
+
+async def main():
+    parser = argparse.ArgumentParser(description="Tensor-parallel CPU scaling benchmark")
+    parser.add_argument("--model", default="gpt2")
+    parser.add_argument("--shards", default="1,2,4", help="comma separated shard counts")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=2)
+    args = parser.parse_args()
+
+    results = []
+    for world_size in (int(n) for n in args.shards.split(",")):
+        tokens, duration = await benchmark(args.model, world_size, args.max_tokens, args.rounds)
+        results.append((world_size, tokens, duration))
+
+    print("\n" + "="*60)
+    print(f"Tensor-parallel scaling: {args.model}")
+    print("="*60)
+    print(f"{'shards':>8} {'tokens':>8} {'seconds':>10} {'tok/s':>10} {'speedup':>8}")
+
+    baseline = None
+    for world_size, tokens, duration in results:
+        throughput = tokens / duration if duration > 0 else 0.0
+        baseline = baseline or throughput
+        print(f"{world_size:>8} {tokens:>8} {duration:>10.2f} {throughput:>10.1f} {throughput / baseline:>7.2f}x")
+
+if __name__ == "__main__":
+    asyncio.run(main())
+
+# run the following command from the repo root:
+# python -m tests.tp_scaling_benchmark --model gpt2 --shards 1,2,4